@@ -0,0 +1,201 @@
+"""Run the system on asyncio
+
+Alternative to the thread orchestration of `main.py` (`EXECUTION_MODE =
+"asyncio"`). Every camera and the serial writer are tasks of one event
+loop, the blocking work (frame reads, image processing, inference, serial
+writes) runs in executors. The tasks live in one `TaskGroup`: if one fails,
+the others are cancelled, and a camera that stops delivering frames is
+stopped after `CAMERA_READ_TIMEOUT`. Needs Python 3.11+.
+
+Usage:
+    python3 async_runtime.py
+"""
+
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from config.camera import CAMERAS
+from config.metrics import METRICS_ENABLED
+from config.model import BATCHED_INFERENCE
+from config.robot import HOME_J6, HOME_J5, HOME_X, HOME_Y, HOME_Z, PREDICTION
+from config.runtime import CAMERA_READ_TIMEOUT, WARM_UP
+from config.telemetry import TELEMETRY_ENABLED, TELEMETRY_PATH
+from config.tracing import TRACE_PATH
+from fusion import MotionFusion
+from helpers import metrics
+from helpers.communication import WRITER, get_connection
+from helpers.startup import mark
+from helpers.synchronization import AsyncCameraSync
+from helpers.telemetry import TELEMETRY
+from helpers.tracing import TRACER
+from model.backends import predict, preload
+from model.inference_service import InferenceService
+from prediction import MotionPredictor
+from robot_commands import PLANNER, homing_async, robot_step
+from vision_system import CameraPipeline
+
+
+async def run_camera(
+    pipeline: CameraPipeline,
+    sync: AsyncCameraSync,
+    executor: ThreadPoolExecutor,
+    ready: asyncio.Future = None,
+):
+    """Capture and process the frames of one camera
+
+    Args:
+        pipeline (CameraPipeline): the camera's processing
+        sync (AsyncCameraSync): freshest results of the cameras
+        executor (ThreadPoolExecutor): runs the blocking stages
+        ready (asyncio.Future, optional): wait for it (e.g. the model being
+        loaded) before processing the first frame
+    """
+    loop = asyncio.get_running_loop()
+    read = None  # the last read, its thread can't be interrupted
+    try:
+        await loop.run_in_executor(executor, pipeline.open)
+        if ready is not None:
+            await asyncio.shield(ready)  # shared by all cameras
+
+        while True:
+            delay = pipeline.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            read = executor.submit(pipeline.read)
+            try:
+                retrieve, frame = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(read)), CAMERA_READ_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                print(f"Camera {pipeline.camera_id}: no frame for {CAMERA_READ_TIMEOUT} s")
+                break
+            frame_time = time.perf_counter()
+            if not retrieve:
+                break
+
+            movement = await loop.run_in_executor(
+                executor, pipeline.process, frame, frame_time, PLANNER.commanded_z.value
+            )
+            if movement is not None:
+                sync.put(pipeline.camera_id, movement)
+    finally:
+        # also when cancelled or failed: the robot stops waiting for this
+        # camera
+        print("STOPPING...")
+        sync.put(pipeline.camera_id, (None,) * 5)
+        if read is not None and not read.done():
+            # never release the source under a blocked read: its thread
+            # releases it once the read returns
+            read.add_done_callback(lambda _: pipeline.release())
+        else:
+            await loop.run_in_executor(executor, pipeline.release)
+        print('STOPPED')
+
+
+async def control_robot_arm(
+    sync: AsyncCameraSync,
+    J6: float,
+    J5: float,
+    X: float,
+    Y: float,
+    Z: float,
+    fusion: MotionFusion = None,
+    predictor: MotionPredictor = None,
+):
+    """Robot arm manipulations, see `main.manipulate_robot_arm`
+
+    Homes the robot when all cameras stopped (or the task is cancelled).
+    """
+    fusion = fusion or MotionFusion()
+    command_index = -1
+
+    try:
+        while True:
+            results = await sync.get()
+            if results is None:
+                break
+            estimates, capture_time = results
+
+            command_index += 1
+            J6, J5, X, Y, Z = robot_step(
+                estimates, capture_time, (J6, J5, X, Y, Z), command_index, fusion, predictor
+            )
+    finally:
+        await homing_async()
+        WRITER.stop()  # the writer task returns once the pending are written
+        print("PRINTER STOPPED")
+
+
+async def run(cameras: dict = CAMERAS, segment: Callable = None):
+    """Run the camera pipelines, the robot loop and the serial writer
+
+    Args:
+        cameras (dict, optional): camera ID -> settings with the "source".
+        Defaults to `CAMERAS`.
+        segment (Callable, optional): segmentation model. Defaults to the
+        shared batched inference worker (`BATCHED_INFERENCE`) or the
+        configured backend.
+    """
+    if sys.version_info < (3, 11):
+        raise RuntimeError("The asyncio runtime needs Python 3.11+ (asyncio.TaskGroup)")
+    loop = asyncio.get_running_loop()
+    sync = AsyncCameraSync(cameras)
+
+    # load and warm up the model in the background while the cameras open
+    ready = None
+    if WARM_UP:
+        ready = loop.run_in_executor(None, preload(len(cameras)).wait)
+
+    service = None
+    if segment is None and BATCHED_INFERENCE:
+        segment = service = InferenceService(predict, max_batch_size=len(cameras))
+        service.start()
+
+    # counters and queue depths on http://METRICS_HOST:METRICS_PORT/metrics
+    metrics_server = None
+    if METRICS_ENABLED:
+        metrics.watch(sync, WRITER, PLANNER, service)
+        metrics_server = metrics.serve()
+
+    # reading and processing of every camera may block at the same time
+    executor = ThreadPoolExecutor(max_workers=2 * len(cameras), thread_name_prefix='camera')
+    try:
+        async with asyncio.TaskGroup() as tasks:
+            writer = tasks.create_task(WRITER.serve())
+            for camera_id, settings in cameras.items():
+                pipeline = CameraPipeline(camera_id, settings['source'], segment=segment)
+                tasks.create_task(run_camera(pipeline, sync, executor, ready))
+            robot = tasks.create_task(
+                control_robot_arm(
+                    sync,
+                    HOME_J6,
+                    HOME_J5,
+                    HOME_X,
+                    HOME_Y,
+                    HOME_Z,
+                    predictor=MotionPredictor() if PREDICTION else None,
+                )
+            )
+            mark('pipeline started')
+            await robot
+            await writer
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if service is not None:
+            service.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        get_connection().close()  # close connector
+    print(f"Dropped results per camera: {sync.dropped}")
+
+
+if __name__ == '__main__':
+    if TELEMETRY_ENABLED:
+        TELEMETRY.open(TELEMETRY_PATH)
+    asyncio.run(run())
+    TELEMETRY.close()
+    if TRACER.enabled:
+        TRACER.dump(TRACE_PATH)
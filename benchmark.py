@@ -0,0 +1,292 @@
+"""Benchmark the full pipeline on recorded frames without the robot
+
+Replays one recording per camera of `CAMERAS` through `capture_frames` and
+drives `move_arm` against a null robot connection, or the simulated robot
+with `ROBOT_PORT=sim`. Reports processed frames/s and p50/p95/p99 latency
+per camera.
+
+Usage:
+    python3 benchmark.py RECORDING [RECORDING ...] [--fast] [--skip N]
+        [--json RESULTS] [--trace TRACE] [--telemetry RECORDS]
+"""
+
+import os
+
+# never open the serial port while benchmarking, only a simulated robot
+if os.environ.get('ROBOT_PORT') != 'sim':
+    os.environ['ROBOT_PORT'] = 'null'
+
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+
+from config.camera import CAMERAS, FRAME_SAMPLING, FRAME_TO_SKIP
+from config.model import BATCHED_INFERENCE, KEYFRAME_INTERVAL
+from config.robot import (
+    HOME_J6,
+    HOME_J5,
+    HOME_X,
+    HOME_Y,
+    HOME_Z,
+    PREDICTION,
+)
+from config.runtime import WARM_UP
+from fusion import MotionFusion
+from helpers import communication
+from helpers.communication import WRITER
+from helpers.startup import TIMINGS
+from helpers.synchronization import CameraSync
+from helpers.telemetry import TELEMETRY
+from helpers.tracing import TRACER, span
+from model.backends import predict, preload
+from model.inference_service import InferenceService
+from prediction import MotionPredictor
+from robot_commands import PLANNER, robot_step
+from tracking import TRACKERS
+from vision_system import capture_frames
+
+PERCENTILES = (50, 95, 99)
+
+
+def drive_null_robot(
+    sync: CameraSync,
+    latencies: list,
+    end_to_end: list,
+    predictor: MotionPredictor = None,
+):
+    """Consume results of all cameras and move the (null) robot
+
+    Unlike `main.manipulate_robot_arm`, does not wait for the robot to home.
+
+    Args:
+        sync (CameraSync): freshest results of the cameras
+        latencies (list): fusion and `move_arm` duration (s) of every command
+        end_to_end (list): time (s) from the frames' capture to every command
+        predictor (MotionPredictor, optional): latency compensation of the
+        fused motion
+    """
+    J6, J5, X, Y, Z = HOME_J6, HOME_J5, HOME_X, HOME_Y, HOME_Z
+    fusion = MotionFusion()
+    command_index = -1
+
+    while True:
+        with span('sync_wait'):
+            results = sync.get()
+        if results is None:
+            break
+        estimates, capture_time = results
+
+        command_index += 1
+        start = time.perf_counter()
+        J6, J5, X, Y, Z = robot_step(
+            estimates, capture_time, (J6, J5, X, Y, Z), command_index, fusion, predictor
+        )
+        end = time.perf_counter()
+        latencies.append(end - start)
+        end_to_end.append(end - capture_time)
+
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    """Frames/s and latency percentiles (ms) of one stage"""
+    summary = {
+        'frames': len(latencies),
+        'fps': len(latencies) / elapsed if elapsed else 0.0,
+    }
+    values = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    for p in PERCENTILES:
+        summary[f'p{p}_ms'] = float(np.percentile(values, p))
+    return summary
+
+
+def run_benchmark(
+    sources: dict,
+    realtime: bool = False,
+    frame_to_skip: int = 1,
+    batched: bool = BATCHED_INFERENCE,
+    keyframe_interval: int = KEYFRAME_INTERVAL,
+    sampling: str = FRAME_SAMPLING,
+    tracker: str = None,
+    prediction: bool = PREDICTION,
+) -> dict:
+    """Run the camera pipelines and the robot loop over recordings
+
+    Args:
+        sources (dict): camera ID -> recorded video or image directory
+        realtime (bool, optional): replay at recorded speed. Defaults to
+        False (as fast as possible).
+        frame_to_skip (int, optional): process every n-th frame. Defaults to 1.
+        batched (bool, optional): share one batched inference worker between
+        the cameras. Defaults to `BATCHED_INFERENCE`.
+        keyframe_interval (int, optional): segment every n-th processed
+        frame. Defaults to `KEYFRAME_INTERVAL`.
+        sampling (str, optional): "skip" or "latest" frame sampling. Defaults
+        to `FRAME_SAMPLING`.
+        tracker (str, optional): tracker backend of all cameras. Defaults to
+        `TRACKER_BACKENDS`.
+        prediction (bool, optional): compensate the latency with the motion
+        predictor. Defaults to `PREDICTION`.
+
+    Returns:
+        dict: summary per camera, for the robot commands and the capture to
+        command latency, dropped results per camera and the robot commands
+        sent/held back by the planner/dropped by the writer (and the moves of
+        the simulated robot), startup milestones
+    """
+    sync = CameraSync(sources)
+    latencies = {camera_id: [] for camera_id in sources}
+    latencies['robot'], latencies['end_to_end'] = [], []
+    ready = preload(len(sources)) if WARM_UP else None
+    segment = None
+    if batched:
+        segment = InferenceService(predict, max_batch_size=len(sources))
+
+    cameras = [
+        threading.Thread(
+            target=capture_frames,
+            args=(camera_id, sync.channel(camera_id)),
+            kwargs=dict(
+                source=source,
+                realtime=realtime,
+                frame_to_skip=frame_to_skip,
+                latencies=latencies[camera_id],
+                segment=segment,
+                keyframe_interval=keyframe_interval,
+                sampling=sampling,
+                tracker=tracker,
+                ready=ready,
+                commanded_z=PLANNER.commanded_z,
+            ),
+        )
+        for camera_id, source in sources.items()
+    ]
+    robot = threading.Thread(
+        target=drive_null_robot,
+        args=(
+            sync,
+            latencies['robot'],
+            latencies['end_to_end'],
+            MotionPredictor() if prediction else None,
+        ),
+    )
+
+    if segment is not None:
+        segment.start()
+    WRITER.start()
+    start = time.perf_counter()
+    for thread in (*cameras, robot):
+        thread.start()
+    for thread in (*cameras, robot):
+        thread.join()
+    elapsed = time.perf_counter() - start
+    WRITER.stop()
+    if segment is not None:
+        segment.stop()
+
+    results = {'elapsed_s': elapsed}
+    for stage, values in latencies.items():
+        name = stage if isinstance(stage, str) else f'camera{stage}'
+        results[name] = summarize(values, elapsed)
+    results['dropped'] = {f'camera{camera_id}': n for camera_id, n in sync.dropped.items()}
+    results['commands'] = {
+        'sent': PLANNER.sent_commands,
+        'held': PLANNER.held_commands,
+        'dropped': WRITER.dropped,
+    }
+    results['startup'] = dict(TIMINGS)
+    if communication.SIMULATOR is not None:
+        # from the frame arriving at the arm to the end of its move
+        moves = [move.finish - move.received for move in communication.SIMULATOR.moves]
+        results['robot_moves'] = summarize(moves, elapsed)
+    return results
+
+
+def print_report(results: dict):
+    print(f"elapsed: {results['elapsed_s']:.2f} s")
+    print(f"{'stage':<12}{'frames':>8}{'fps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for stage, s in results.items():
+        if stage in ('elapsed_s', 'dropped', 'commands', 'startup'):
+            continue
+        print(
+            f"{stage:<12}{s['frames']:>8}{s['fps']:>9.2f}"
+            f"{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}{s['p99_ms']:>9.2f}"
+        )
+    print(f"dropped results: {results['dropped']}")
+    print(f"robot commands: {results['commands']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        'recordings',
+        nargs='+',
+        help=f"recording (video or image dir) per camera of {list(CAMERAS)}",
+    )
+    parser.add_argument(
+        '--fast', action='store_true', help="replay as fast as possible"
+    )
+    parser.add_argument(
+        '--skip',
+        type=int,
+        default=None,
+        help=f"process every n-th frame (default: 1 with --fast, else {FRAME_TO_SKIP})",
+    )
+    parser.add_argument(
+        '--batched',
+        action=argparse.BooleanOptionalAction,
+        default=BATCHED_INFERENCE,
+        help="share one batched inference worker between the cameras",
+    )
+    parser.add_argument(
+        '--keyframe-interval',
+        type=int,
+        default=KEYFRAME_INTERVAL,
+        help="segment every n-th processed frame (1 - every frame)",
+    )
+    parser.add_argument(
+        '--sampling', choices=('skip', 'latest'), default=FRAME_SAMPLING
+    )
+    parser.add_argument('--tracker', choices=list(TRACKERS))
+    parser.add_argument(
+        '--predict',
+        action=argparse.BooleanOptionalAction,
+        default=PREDICTION,
+        help="compensate the latency with the Kalman motion predictor",
+    )
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument(
+        '--trace', help="record per-stage spans to this file (.json or .jsonl)"
+    )
+    parser.add_argument(
+        '--telemetry', help="record every frame and command to this .npy file"
+    )
+    args = parser.parse_args()
+    if len(args.recordings) != len(CAMERAS):
+        parser.error(f"expected {len(CAMERAS)} recordings, one per camera")
+    if args.sampling == 'latest' and args.fast:
+        parser.error("--sampling latest needs a realtime replay, drop --fast")
+    if args.trace:
+        TRACER.enabled = True
+    if args.telemetry:
+        TELEMETRY.open(args.telemetry)
+
+    skip = args.skip or (1 if args.fast else FRAME_TO_SKIP)
+    results = run_benchmark(
+        dict(zip(CAMERAS, args.recordings)),
+        not args.fast,
+        skip,
+        args.batched,
+        args.keyframe_interval,
+        args.sampling,
+        args.tracker,
+        args.predict,
+    )
+    TELEMETRY.close()
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.trace:
+        TRACER.dump(args.trace)
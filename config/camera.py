@@ -1,14 +1,72 @@
 """Camera configuration: frame size"""
 
+import cv2
+
+from config.robot import HOME_Z
+
 ### Cameras
 TOP_CAMERA_ID = 0
 BOTTOM_CAMERA_ID = 2
+CAMERA_API = cv2.CAP_DSHOW  # capture backend for live cameras
+
+### Frame sources
+# camera index for a live camera, or a path to a recorded video / image
+# directory to replay instead of it
+TOP_CAMERA_SOURCE = TOP_CAMERA_ID
+BOTTOM_CAMERA_SOURCE = BOTTOM_CAMERA_ID
+REPLAY_REALTIME = True  # replay at recorded speed, False - as fast as possible
+REPLAY_FPS = 30  # frame rate of image directories (and videos without one)
+
+### Camera topology
+# camera ID -> frame source and the robot axes its tracked motion drives.
+# The image's "rotation" (deg), "x" and "y" (mm) are mapped to "J6", "J5",
+# "X", "Y" or "Z", a "-" prefix inverts the direction. Every camera runs its
+# own pipeline; an axis seen by several cameras gets the mean of their
+# estimates weighted by the tracking confidence.
+CAMERAS = {
+    TOP_CAMERA_ID: dict(
+        source=TOP_CAMERA_SOURCE, dofs=dict(rotation="J6", x="X", y="Y")
+    ),
+    BOTTOM_CAMERA_ID: dict(
+        source=BOTTOM_CAMERA_SOURCE, dofs=dict(rotation="J5", y="Z")
+    ),
+}
 
 ### Frame properties
 FRAME_HEIGHT = 720  # height of the frame
 FRAME_WIDTH = 1280  # width of the frame
 
+### Frame sampling
+# "skip" - process every FRAME_TO_SKIP-th frame, the skipped ones are only
+# grabbed, never decoded
+# "latest" - a grabber thread keeps only the newest frame, which is decoded
+# when the previous one is processed, at most MAX_SAMPLE_RATE times a second
+FRAME_SAMPLING = "skip"
+FRAME_TO_SKIP = 30  # process every n-th frame
+MAX_SAMPLE_RATE = 10  # (Hz)
+
 ### Calibration
 # ! Depends on camera and distance
-# should be dynamic
-SCALE = 0.45  # mm/px
+SCALE = 0.45  # mm/px at HOME_Z
+# camera ID -> ((robot Z (mm), scale (mm/px)), ...) measured at several
+# heights, interpolated once into a lookup table every SCALE_Z_STEP mm and
+# indexed by the last commanded Z. Cameras not listed keep SCALE
+SCALE_TABLES = {
+    TOP_CAMERA_ID: ((HOME_Z, SCALE),),
+    BOTTOM_CAMERA_ID: ((HOME_Z, SCALE),),
+}
+SCALE_Z_STEP = 0.5  # mm
+# follow the tracked scale change instead: mm/px shrinks as the surface
+# comes closer. The changes are chained from the calibrated scale at the
+# last keyframe (segmentation), so tracking errors do not add up beyond
+# one keyframe interval, and kept within DYNAMIC_SCALE_RANGE times it
+DYNAMIC_SCALE = False
+DYNAMIC_SCALE_RANGE = 0.5, 2.0
+
+### Lens correction
+# camera ID -> .npz with the `camera_matrix` (3x3) and `dist_coeffs` of
+# `cv2.calibrateCamera`, None - no correction
+INTRINSICS = {TOP_CAMERA_ID: None, BOTTOM_CAMERA_ID: None}
+# "points" - undistort the tracked points only, "roi" - remap the cropped
+# ROIs (for trackers without points, e.g. "phase"); never the whole frame
+UNDISTORT = "points"
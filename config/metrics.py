@@ -0,0 +1,10 @@
+"""Configuration of the live metrics endpoint"""
+
+### Metrics
+# serve counters and histograms in the Prometheus text format on
+# http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = False
+METRICS_HOST = "127.0.0.1"  # local only
+METRICS_PORT = 9108
+# (s) upper bounds of the latency histograms' buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
@@ -1,14 +1,55 @@
 """Configuration for U-Net model loading and prediction"""
 
 ### Load the model
-MODEL_PATH = r"wound_segmentation_chkp"
-NET_SIZE = (128, 128, 1)
+MODEL_PATH = r"wound_segmentation_chkp"  # weights of the reference model
+
+### Model variants
+# reduced U-Nets distilled from the reference model (`python3 -m
+# model.distill`), compared with `python3 -m model.variants`.
+# width - channels of every level relative to the reference (64 ... 512),
+# depth - pooling levels (3 in the reference), size - input height/width,
+# divisible by 2 ** depth
+MODEL_VARIANTS = {
+    "reference": dict(width=1.0, depth=3, size=128),
+    "half": dict(width=0.5, depth=3, size=128),
+    "quarter": dict(width=0.25, depth=3, size=128),
+    "quarter_96": dict(width=0.25, depth=3, size=96),
+    "quarter_shallow": dict(width=0.25, depth=2, size=96),
+}
+MODEL_VARIANT = "reference"
+VARIANT_MODEL_PATH = r"wound_segmentation_{}.weights.h5"  # distilled weights
+NET_SIZE = (MODEL_VARIANTS[MODEL_VARIANT]["size"],) * 2 + (1,)
+
+### Inference backend
+# "keras" - eager Keras model (reference)
+# "tf_function" - graph-compiled tf.function, traced once from the checkpoint
+# "onnx" - exported ONNX model run with onnxruntime
+# "tflite" - float16/int8-quantized TFLite model
+INFERENCE_BACKEND = "keras"
+ONNX_MODEL_PATH = r"wound_segmentation.onnx"
+TFLITE_QUANTIZATION = "int8"  # "float16" or "int8"
+TFLITE_QUANTIZED_PATH = r"wound_segmentation_{}.tflite"  # per quantization
+TFLITE_MODEL_PATH = TFLITE_QUANTIZED_PATH.format(TFLITE_QUANTIZATION)
+INFERENCE_THREADS = None  # CPU threads for onnxruntime/TFLite, None - default
 
 ### Configuration for predictions
-IMG_SIZE = (128, 128)
+IMG_SIZE = NET_SIZE[:2]  # (width, height) of the resized frame
 BASE_THRESHOLD = 0.7
 MIN_THRESHOLD = 0.1
 THRESHOLD_STEP = 0.1
 
 ### Post-processing
 ROI_BORDER = 5  # px
+
+### Keyframe-gated segmentation
+# segment every n-th processed frame, in between the previous ROI is shifted
+# by the tracked motion. 1 - segment every frame
+KEYFRAME_INTERVAL = 1
+KEYFRAME_MIN_MATCHES = 10  # segment earlier if fewer good matches
+KEYFRAME_MIN_INLIER_RATIO = 0.5  # ... or fewer RANSAC inliers
+KEYFRAME_MIN_PHASE_RESPONSE = 0.2  # ... or a weaker peak ("phase" tracker)
+
+### Shared inference service
+BATCHED_INFERENCE = True  # segment frames of all cameras in shared batches
+MAX_BATCH_SIZE = 8  # upper limit, main.py closes a batch once every camera is in
+BATCH_DEADLINE = 0.005  # (s) how long to wait for more frames after the first
@@ -1,17 +1,23 @@
 """Basic robot's configuration"""
 
-import serial
-
-### Initialise connector from the host computer to the robot
-# Windows
-CONN = serial.Serial(
-    'COM3',
-    baudrate=115200,
-    timeout=None,
-    bytesize=8,
-    stopbits=serial.STOPBITS_ONE,
-    parity=serial.PARITY_NONE,
-)
+import os
+
+### Connector from the host computer to the robot
+# opened on the first command (`helpers.communication.get_connection`)
+# port name or pySerial URL, can be overridden with the ROBOT_PORT
+# environment variable. `null` discards all commands (no robot attached),
+# `sim` starts a simulated robot on a pseudo-terminal (Linux/macOS)
+ROBOT_PORT = os.environ.get('ROBOT_PORT', 'COM3')  # Windows
+NULL_PORT = 'null'
+SIM_PORT = 'sim'
+BAUDRATE = 115200
+
+# commands waiting for the serial writer thread, the oldest is dropped when
+# full (every G1 frame is an absolute position, the newest supersedes it)
+COMMAND_QUEUE_SIZE = 4
+
+### Axes
+AXES = ("J6", "J5", "X", "Y", "Z")  # order of the G1 command arguments
 
 ### Home position
 HOME_J6 = 0  # (deg) initial position of Joint 6 - wrist (aw)
@@ -23,3 +29,31 @@ HOME_SPEED = 1000  # (mm/min) slower speed for homing
 
 ### Main action
 MEAN_SPEED = 2500  # (mm/min) not fast and not slow
+
+### Motion planning
+# moves smaller than the deadband (from the last sent position) are held
+# back, the motion is kept and sent once it adds up
+DEADBAND = dict(J6=0.2, J5=0.2, X=0.2, Y=0.2, Z=0.2)  # (deg / mm)
+MAX_COMMAND_RATE = 10  # (Hz) G1 frames the arm can execute
+# ! Depends on the mounting: reachable (min, max) per axis, commands are
+# clamped into it
+WORKSPACE = dict(
+    J6=(-180, 180),  # (deg)
+    J5=(-90, 90),  # (deg)
+    X=(0, 400),  # (mm)
+    Y=(-300, 300),  # (mm)
+    Z=(0, 300),  # (mm)
+)
+
+### Motion prediction
+# constant-velocity Kalman filter per axis between the fusion and the robot:
+# smooths the measured motion and extrapolates it to when the command is
+# executed
+PREDICTION = False
+# white noise acceleration ((deg or mm)^2/s^3), higher follows changes faster
+PREDICTOR_PROCESS_NOISE = dict(J6=50.0, J5=50.0, X=500.0, Y=500.0, Z=500.0)
+# variance of a measured position ((deg or mm)^2)
+PREDICTOR_MEASUREMENT_NOISE = dict(J6=0.5, J5=0.5, X=1.0, Y=1.0, Z=1.0)
+# (s) from sending a command to the arm acting on it, added to the measured
+# capture to command latency
+PREDICTOR_EXECUTION_DELAY = 0.05
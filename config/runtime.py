@@ -0,0 +1,27 @@
+"""Configuration of how the camera pipelines and the robot loop are run"""
+
+### Execution mode
+# "threads" - every camera pipeline is a thread of the main process
+# "processes" - every camera pipeline is a worker process, segmentation runs
+# in the main process and frames/masks are exchanged through shared memory
+# "asyncio" - cameras, robot loop and serial writer are tasks of one event
+# loop, blocking stages run in executors (`async_runtime.py`)
+EXECUTION_MODE = "threads"
+SHARED_RING_SLOTS = 2  # frame/mask slots per camera process
+# "spawn" - start workers without inheriting the main process' model and
+# inference threads (forking them is unsafe)
+PROCESS_START_METHOD = "spawn"
+
+### Camera synchronization
+# results of the cameras are paired for one robot command if they come
+# within this window, otherwise the robot moves on what it has (s)
+SYNC_WINDOW = 0.05
+
+### Startup
+# load the model in the background while the cameras open, then run one
+# inference and tracking pass on blank/first frames before processing
+WARM_UP = True
+
+### Asyncio runtime
+# a camera that does not deliver a frame for this long is stopped (s)
+CAMERA_READ_TIMEOUT = 5.0
@@ -0,0 +1,9 @@
+"""Configuration of the simulated robot arm (ROBOT_PORT=sim)"""
+
+### Motion model
+SIM_JOINT_SPEED = 90  # (deg/s) J5/J6 speed, linear axes use the G1 speed
+SIM_SETTLE_TIME = 0.02  # (s) added to every move
+
+### Acknowledgement
+# echo every G1 frame back once its move is finished
+SIM_ACK = True
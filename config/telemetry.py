@@ -0,0 +1,7 @@
+"""Configuration of the per-frame telemetry recorder"""
+
+### Telemetry
+TELEMETRY_ENABLED = False
+# NumPy .npy file, memory-mapped and preallocated (sparse until written)
+TELEMETRY_PATH = "telemetry.npy"
+TELEMETRY_CAPACITY = 1_000_000  # records, about 100 B each; later ones are dropped
@@ -0,0 +1,13 @@
+"""Configuration for per-stage latency tracing"""
+
+### Tracing
+# a diagnostic: when on, every run keeps up to TRACE_BUFFER_SIZE spans in
+# memory and writes them to TRACE_PATH (one file per camera process) at exit.
+# Off, the instrumented stages cost one shared no-op context manager
+TRACING_ENABLED = False
+TRACE_BUFFER_SIZE = 100_000  # spans kept in the ring buffer, oldest dropped
+
+### Export
+# `.jsonl` - one span per line, anything else - Chrome trace (open in
+# chrome://tracing or https://ui.perfetto.dev)
+TRACE_PATH = "trace.json"
@@ -1,20 +1,41 @@
 """Configuration for tracking algorithms"""
 
-import cv2
-import numpy as np
+from config.camera import BOTTOM_CAMERA_ID, TOP_CAMERA_ID
+
+### Tracker backend per camera
+# "sift" - SIFT features + FLANN (KD-tree) matcher
+# "orb" - ORB features + brute-force Hamming matcher
+# "akaze" - AKAZE features + FLANN (LSH) matcher
+# "klt" - pyramidal Lucas-Kanade optical flow on carried over corners
+# "phase" - phase correlation, translation only
+TRACKER_BACKENDS = {TOP_CAMERA_ID: "sift", BOTTOM_CAMERA_ID: "sift"}
+DEFAULT_TRACKER = "sift"  # for cameras not listed above
 
 ### Choose feature extraction and matching algorithms
-SIFT = cv2.SIFT_create(nfeatures=100)  # feature extractor (SIFT here)
-# parameters for matcher
+# extractors and matchers are created per tracker (see `tracking.TRACKERS`)
+SIFT_FEATURES = 100  # feature extractor (SIFT here)
+# parameters for matcher (FLANN in our case OR try BF matcher instead:
+# cv2.BFMatcher(cv2.NORM_L2, crossCheck=False))
 index_params = dict(algorithm=1, trees=4)
 search_params = dict(checks=10)
-FLANN = cv2.FlannBasedMatcher(
-    index_params, search_params
-)  # feature matcher (FLANN in our case OR try BF matcher instead (line below))
-# feature_matcher_BF = cv2.BFMatcher(cv2.NORM_L2, crossCheck=False)
 
 # filter for good matches
 FLANN_THRESHOLD = 0.8
 
-# function to use to get one number from a list of displacements
-APPROX_FUNC = np.median
+### Binary features (ORB / AKAZE)
+ORB_FEATURES = 500
+# FLANN LSH index for binary descriptors
+lsh_index_params = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)
+
+### Optical flow (KLT)
+KLT_MAX_CORNERS = 100
+KLT_QUALITY = 0.01  # minimal accepted corner quality (relative to the best)
+KLT_MIN_DISTANCE = 7  # px between corners
+KLT_WIN_SIZE = (21, 21)  # px search window per pyramid level
+KLT_MAX_LEVEL = 3  # pyramid levels
+KLT_MIN_POINTS = 20  # detect new corners when fewer are carried over
+
+### Motion estimation
+# one similarity transform (translation, rotation, scale) per frame
+MOTION_ESTIMATOR = "ransac"  # "ransac" or "lmeds"
+RANSAC_REPROJ_THRESHOLD = 3.0  # px
@@ -0,0 +1,62 @@
+"""Fusion of the cameras' motion estimates into one robot command"""
+
+from config.camera import CAMERAS
+from config.robot import AXES
+
+COMPONENTS = ('rotation', 'x', 'y')  # order of a camera's movement values
+
+
+class MotionFusion:
+    """Combine any number of camera estimates into the 5-DOF command
+
+    Every axis gets the mean of the estimates of the cameras driving it,
+    weighted by their tracking confidence. Axes no camera (or only cameras
+    with zero confidence) sees are not moved.
+
+    Args:
+        cameras (dict, optional): camera ID -> settings with the "dofs"
+        mapping. Defaults to `CAMERAS`.
+    """
+
+    def __init__(self, cameras: dict = CAMERAS):
+        # camera ID -> [(component index, axis index, sign), ...]
+        self.mapping = {}
+        for camera_id, settings in cameras.items():
+            links = []
+            for component, axis in settings['dofs'].items():
+                sign = -1.0 if axis.startswith('-') else 1.0
+                axis = axis.lstrip('-')
+                if component not in COMPONENTS:
+                    raise ValueError(
+                        f"Camera {camera_id}: unknown component {component!r}, "
+                        f"use one of {list(COMPONENTS)}"
+                    )
+                if axis not in AXES:
+                    raise ValueError(
+                        f"Camera {camera_id}: unknown axis {axis!r}, use one of {list(AXES)}"
+                    )
+                links.append((COMPONENTS.index(component), AXES.index(axis), sign))
+            self.mapping[camera_id] = links
+
+    def __call__(self, estimates: dict) -> tuple[float, float, float, float, float]:
+        """Fuse the cameras' last estimates
+
+        Args:
+            estimates (dict): camera ID -> (rotation, x, y, confidence) of
+            its last processed frame
+
+        Returns:
+            tuple[float, float, float, float, float]: J6, J5 (deg) and X, Y,
+            Z (mm) to add
+        """
+        totals = [0.0] * len(AXES)
+        weights = [0.0] * len(AXES)
+        for camera_id, movement in estimates.items():
+            confidence = movement[-1]
+            for component, axis, sign in self.mapping[camera_id]:
+                totals[axis] += confidence * sign * movement[component]
+                weights[axis] += confidence
+        return tuple(
+            total / weight if weight > 0 else 0.0
+            for total, weight in zip(totals, weights)
+        )
@@ -0,0 +1,120 @@
+"""Per-camera calibration: lens correction and pixel to millimetre scale
+
+Everything is precomputed when a camera opens: the undistortion maps of the
+whole frame (`cv2.initUndistortRectifyMap`) and the scale of every Z step.
+Per frame only the ROI is remapped, or only the tracked points are
+undistorted, and the scale is one table lookup.
+"""
+
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from config.camera import (
+    FRAME_HEIGHT,
+    FRAME_WIDTH,
+    INTRINSICS,
+    SCALE,
+    SCALE_TABLES,
+    SCALE_Z_STEP,
+)
+from config.robot import HOME_Z
+
+
+class CameraCalibration:
+    """Lens correction and Z-dependent scale of one camera
+
+    Undistorted coordinates keep the camera matrix, so they stay in the
+    frame's pixel units.
+
+    Args:
+        camera_matrix (np.ndarray, optional): 3x3 intrinsics. Defaults to
+        None (no lens correction).
+        dist_coeffs (np.ndarray, optional): distortion coefficients
+        scale_table (tuple, optional): (robot Z (mm), scale (mm/px)) pairs.
+        Defaults to `SCALE` at any Z.
+        z_step (float, optional): (mm) resolution of the scale lookup.
+        Defaults to `SCALE_Z_STEP`.
+        reference_z (float, optional): (mm) Z assumed before the first
+        command. Defaults to `HOME_Z`.
+        frame_size (tuple[int, int], optional): (width, height). Defaults to
+        (`FRAME_WIDTH`, `FRAME_HEIGHT`).
+    """
+
+    def __init__(
+        self,
+        camera_matrix: np.ndarray = None,
+        dist_coeffs: np.ndarray = None,
+        scale_table: tuple = ((HOME_Z, SCALE),),
+        z_step: float = SCALE_Z_STEP,
+        reference_z: float = HOME_Z,
+        frame_size: tuple[int, int] = (FRAME_WIDTH, FRAME_HEIGHT),
+    ):
+        self.camera_matrix = camera_matrix
+        self.dist_coeffs = dist_coeffs
+        self.map_x = self.map_y = None
+        if camera_matrix is not None:
+            self.map_x, self.map_y = cv2.initUndistortRectifyMap(
+                camera_matrix, dist_coeffs, None, camera_matrix, frame_size, cv2.CV_32FC1
+            )
+
+        # scale at every `z_step` between the measured heights, the ends are
+        # extended beyond them
+        heights, scales = zip(*sorted(scale_table))
+        self.z_min, self.z_step = heights[0], z_step
+        grid = np.arange(heights[0], heights[-1] + z_step, z_step)
+        self.scales = np.interp(grid, heights, scales).tolist()
+        self.reference_z = reference_z
+
+    @classmethod
+    def for_camera(cls, camera_id: int) -> 'CameraCalibration':
+        """Calibration of a camera from `INTRINSICS` and `SCALE_TABLES`"""
+        camera_matrix = dist_coeffs = None
+        path = INTRINSICS.get(camera_id)
+        if path is not None:
+            with np.load(path) as data:
+                camera_matrix, dist_coeffs = data['camera_matrix'], data['dist_coeffs']
+        scale_table = SCALE_TABLES.get(camera_id, ((HOME_Z, SCALE),))
+        return cls(camera_matrix, dist_coeffs, scale_table)
+
+    @property
+    def undistorts(self) -> bool:
+        return self.camera_matrix is not None
+
+    def scale(self, z: Optional[float] = None) -> float:
+        """(mm/px) at the robot's Z, at `reference_z` if unknown"""
+        if z is None:
+            z = self.reference_z
+        index = round((z - self.z_min) / self.z_step)
+        return self.scales[min(max(index, 0), len(self.scales) - 1)]
+
+    def crop(self, gray: np.ndarray, box: tuple[int, int, int, int]) -> np.ndarray:
+        """Undistorted crop box of a frame
+
+        Only the box is remapped, with the frame's maps cut to it.
+
+        Args:
+            gray (np.ndarray): frame in grayscale
+            box (tuple[int, int, int, int]): row min/max, column min/max
+
+        Returns:
+            np.ndarray: crop of the undistorted frame
+        """
+        row_min, row_max, col_min, col_max = box
+        if self.map_x is None:
+            return gray[row_min:row_max, col_min:col_max]
+        return cv2.remap(
+            gray,
+            self.map_x[row_min:row_max, col_min:col_max],
+            self.map_y[row_min:row_max, col_min:col_max],
+            cv2.INTER_LINEAR,
+        )
+
+    def undistort_points(self, points: np.ndarray) -> np.ndarray:
+        """Undistort (N, 1, 2) points in frame coordinates"""
+        if self.camera_matrix is None or not len(points):
+            return points
+        return cv2.undistortPoints(
+            points, self.camera_matrix, self.dist_coeffs, P=self.camera_matrix
+        )
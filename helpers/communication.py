@@ -1,24 +1,170 @@
 """Communication protocol with the robot arm (SEED S6H4D robot arm)"""
 
-import struct
+import asyncio
+import collections
+import multiprocessing as mp
+import threading
+import time
 
-from config.robot import CONN
+from config.robot import BAUDRATE, COMMAND_QUEUE_SIZE, NULL_PORT, ROBOT_PORT, SIM_PORT
+from helpers.g1_frame import G1_FRAME, encode_G1
+from helpers.metrics import SERIAL_WRITE_SECONDS
+from helpers.null_connection import NullConnection
+from helpers.robot_simulator import RobotSimulator
+from helpers.tracing import span
 
+SIMULATOR = None  # simulated robot of `ROBOT_PORT=sim`, once connected
+_connection = None
+_connection_lock = threading.Lock()
 
-def format_message(value: float) -> list[int]:
-    """Convert float to a hexadecimal string
 
-    1.	Format float numbers into the IEEE 754 binary32 single-precision format.
-    2.	Convert every byte to a lowercase hexadecimal string prefixed with “0x”.
-    3.	Convert the hexadecimal representation to an integer with 16 bases
-
-    Args:
-        value (float): input float number
+def get_connection():
+    """Connection to the robot, opened on the first call and shared afterwards
 
     Returns:
-        list: list of hexadecimal
+        serial.Serial | NullConnection: connection of `ROBOT_PORT`
+    """
+    global _connection, SIMULATOR
+    with _connection_lock:
+        if _connection is not None:
+            return _connection
+
+        # camera worker processes never talk to the robot
+        if ROBOT_PORT == NULL_PORT or mp.parent_process() is not None:
+            _connection = NullConnection()
+            return _connection
+
+        import serial
+
+        port = ROBOT_PORT
+        if ROBOT_PORT == SIM_PORT:
+            SIMULATOR = RobotSimulator()
+            SIMULATOR.start()
+            port = SIMULATOR.port
+        _connection = serial.serial_for_url(
+            port,
+            baudrate=BAUDRATE,
+            timeout=None,
+            bytesize=8,
+            stopbits=serial.STOPBITS_ONE,
+            parity=serial.PARITY_NONE,
+        )
+        return _connection
+
+
+class SerialWriter:
+    """Writes G1 commands to the robot in its own thread
+
+    `send` only hands the position over, so the vision and control loops
+    never block on the serial port. Pending commands are bounded by
+    `max_pending`: as every frame is an absolute position, the oldest one is
+    dropped (and counted) for the newest. Until it is started (or served,
+    or after it is stopped) commands are written directly.
+
+    The writer runs either as a thread (`start`) or as a task of the asyncio
+    runtime (`serve`).
+
+    Args:
+        conn (optional): serial connection. Defaults to `get_connection()`,
+        opened on start or the first write.
+        max_pending (int, optional): commands waiting to be written. Defaults
+        to `COMMAND_QUEUE_SIZE`.
     """
-    return [int(hex(i), 16) for i in struct.pack('f', value)]
+
+    def __init__(self, conn=None, max_pending: int = COMMAND_QUEUE_SIZE):
+        self.conn = conn
+        self.dropped = 0
+        self._buffer = bytearray(G1_FRAME.size)
+        self._pending = collections.deque(maxlen=max_pending)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._wakeup = None  # wakes up `serve` from any thread
+        self._stopping = False
+
+    @property
+    def pending(self) -> int:
+        """Commands waiting to be written"""
+        return len(self._pending)
+
+    def start(self):
+        """Open the connection and start the writer thread"""
+        if self.conn is None:
+            self.conn = get_connection()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='serial_writer', daemon=True)
+        self._thread.start()
+
+    async def serve(self):
+        """Write the commands as an asyncio task until `stop`
+
+        The (blocking) serial writes run in the loop's default executor.
+        """
+        loop = asyncio.get_running_loop()
+        if self.conn is None:
+            self.conn = await loop.run_in_executor(None, get_connection)
+        wakeup = asyncio.Event()
+        self._stopping = False
+        self._wakeup = lambda: loop.call_soon_threadsafe(wakeup.set)
+        try:
+            while True:
+                await wakeup.wait()
+                wakeup.clear()
+                while True:
+                    with self._condition:
+                        if not self._pending:
+                            break
+                        command = self._pending.popleft()
+                    await loop.run_in_executor(None, self._write, command)
+                if self._stopping:
+                    break
+        finally:
+            self._wakeup = None
+
+    def stop(self):
+        """Write pending commands and stop the writer"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._wakeup is not None:
+            self._wakeup()  # `serve` returns once the pending are written
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def send(self, command: tuple):
+        """Queue (j6, j5, x, y, z, speed) to be written"""
+        if self._thread is None and self._wakeup is None:
+            self._write(command)
+            return
+        with self._condition:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(command)
+            self._condition.notify()
+        if self._wakeup is not None:
+            self._wakeup()
+
+    def _write(self, command: tuple):
+        if self.conn is None:
+            self.conn = get_connection()
+        encode_G1(self._buffer, *command)
+        start = time.perf_counter()
+        with span('serial_write'):
+            self.conn.write(self._buffer)  # send instructions
+        SERIAL_WRITE_SECONDS.labels().observe(time.perf_counter() - start)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    break
+                command = self._pending.popleft()
+            self._write(command)
+
+
+WRITER = SerialWriter()
 
 
 def send_message_G1(
@@ -35,20 +181,4 @@ def send_message_G1(
         j6, j5, x, y, z (float): new position
         speed (float): selected speed (mm/min)
     """
-    # Pack instruction frame
-    instruction = [0] * 48  # frame consists of 48 bytes
-    instruction[0] = [238]  # frame head - G1 code equivalent
-    instruction[1] = '1'.encode()
-    instruction[2] = 1
-    # every code takes 4 bytes
-    instruction[3:7] = format_message(x)  # x
-    instruction[7:11] = format_message(y)  # y
-    instruction[11:15] = format_message(z)  # z
-    instruction[15:19] = format_message(j5)  # J5
-    instruction[23:27] = format_message(j6)  # J6
-    instruction[43:47] = format_message(speed)  # speed
-    instruction[47] = 239  # frame tail
-
-    # convert instructions to bytes
-    full_instr = bytes(instruction[0]) + instruction[1] + bytes(instruction[2:])
-    CONN.write(full_instr)  # send instructions
+    WRITER.send((j6, j5, x, y, z, speed))
@@ -0,0 +1,51 @@
+"""Preallocated frame buffers of one camera"""
+
+import numpy as np
+
+from config.camera import FRAME_HEIGHT, FRAME_WIDTH
+from config.model import IMG_SIZE
+
+
+class FramePool:
+    """Buffers reused for every frame of one camera
+
+    Frames are read into `frame`, converted into one of two gray buffers and
+    the model input is normalized into `batch`, so the steady state
+    allocates no frame-sized arrays. Two gray buffers are needed because the
+    camera's `CameraState` keeps the previous gray frame.
+
+    Args:
+        height (int, optional): frame height. Defaults to `FRAME_HEIGHT`.
+        width (int, optional): frame width. Defaults to `FRAME_WIDTH`.
+        img_size (tuple[int, int], optional): model input (width, height).
+        Defaults to `IMG_SIZE`.
+    """
+
+    def __init__(
+        self,
+        height: int = FRAME_HEIGHT,
+        width: int = FRAME_WIDTH,
+        img_size: tuple[int, int] = IMG_SIZE,
+    ):
+        self.frame = np.empty((height, width, 3), np.uint8)  # BGR
+        self._grays = (
+            np.empty((height, width), np.uint8),
+            np.empty((height, width), np.uint8),
+        )
+        self.resized = np.empty(img_size[::-1], np.uint8)  # gray at model size
+        self.batch = np.empty((1, *img_size[::-1]), np.float32)  # model input
+
+    def gray(self, in_use: np.ndarray = None) -> np.ndarray:
+        """Gray buffer that does not hold `in_use`
+
+        Args:
+            in_use (np.ndarray, optional): gray frame still needed, e.g. the
+            camera's previous one
+
+        Returns:
+            np.ndarray: buffer to convert the next frame into
+        """
+        first, second = self._grays
+        if in_use is not None and np.may_share_memory(first, in_use):
+            return second
+        return first
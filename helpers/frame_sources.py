@@ -0,0 +1,257 @@
+"""Frame sources: live cameras, recorded videos and image directories"""
+
+import os
+import threading
+import time
+from typing import Union
+
+import cv2
+import numpy as np
+
+from config.camera import (
+    CAMERA_API,
+    FRAME_HEIGHT,
+    FRAME_WIDTH,
+    REPLAY_FPS,
+    REPLAY_REALTIME,
+)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+class _Pacer:
+    """Hold replayed frames back until their recorded time"""
+
+    def __init__(self, fps: float):
+        self.period = 1 / fps
+        self.start = None
+        self.index = 0
+
+    def wait(self):
+        """Sleep until the next frame is due"""
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+        delay = self.start + self.index * self.period - now
+        if delay > 0:
+            time.sleep(delay)
+        self.index += 1
+
+
+def _fit_frame(frame: np.ndarray, image: np.ndarray = None) -> np.ndarray:
+    """Resize a recorded frame to the configured frame size if it differs
+
+    Args:
+        frame (np.ndarray): decoded frame
+        image (np.ndarray, optional): buffer to write the frame into
+    """
+    if frame.shape[:2] != (FRAME_HEIGHT, FRAME_WIDTH):
+        return cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT), dst=image)
+    if image is not None and image is not frame and image.shape == frame.shape:
+        np.copyto(image, frame)
+        return image
+    return frame
+
+
+class VideoFileSource:
+    """Replay a recorded video file
+
+    Mirrors the `cv2.VideoCapture` reading interface (`grab`, `retrieve`,
+    `read`, `release`), so it can stand in for a live camera. Like it,
+    `retrieve` and `read` decode into `image` if given.
+
+    Args:
+        path (str): path to the video file
+        realtime (bool, optional): replay at recorded speed, otherwise as
+        fast as possible. Defaults to `REPLAY_REALTIME`.
+    """
+
+    def __init__(self, path: str, realtime: bool = REPLAY_REALTIME):
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise IOError(f"Cannot open video {path}")
+        fps = self._capture.get(cv2.CAP_PROP_FPS) or REPLAY_FPS
+        self._pacer = _Pacer(fps) if realtime else None
+
+    def grab(self) -> bool:
+        if self._pacer:
+            self._pacer.wait()
+        return self._capture.grab()
+
+    def retrieve(self, image: np.ndarray = None) -> tuple[bool, np.ndarray]:
+        retrieve, frame = self._capture.retrieve(image)
+        if not retrieve:
+            return False, None
+        return True, _fit_frame(frame, image)
+
+    def read(self, image: np.ndarray = None) -> tuple[bool, np.ndarray]:
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self):
+        self._capture.release()
+
+
+class ImageDirSource:
+    """Replay a directory of recorded frames in file name order
+
+    Args:
+        path (str): directory with the images
+        realtime (bool, optional): replay at `fps`, otherwise as fast as
+        possible. Defaults to `REPLAY_REALTIME`.
+        fps (float, optional): recorded frame rate. Defaults to `REPLAY_FPS`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        realtime: bool = REPLAY_REALTIME,
+        fps: float = REPLAY_FPS,
+    ):
+        self._files = sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self._files:
+            raise IOError(f"No images found in {path}")
+        self._index = -1
+        self._pacer = _Pacer(fps) if realtime else None
+
+    def grab(self) -> bool:
+        # only move to the next file, decoding happens in `retrieve`
+        if self._pacer:
+            self._pacer.wait()
+        self._index += 1
+        return self._index < len(self._files)
+
+    def retrieve(self, image: np.ndarray = None) -> tuple[bool, np.ndarray]:
+        if not 0 <= self._index < len(self._files):
+            return False, None
+        frame = cv2.imread(self._files[self._index], cv2.IMREAD_COLOR)
+        if frame is None:
+            return False, None
+        return True, _fit_frame(frame, image)
+
+    def read(self, image: np.ndarray = None) -> tuple[bool, np.ndarray]:
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self):
+        self._index = len(self._files)
+
+
+class LatestFrameGrabber:
+    """Grab frames in a background thread, decode only the newest on demand
+
+    The thread keeps calling `grab()` on the source, so the device buffer
+    never holds stale frames. `read()` asks the thread to `retrieve()` the
+    next grabbed frame, so frames nobody reads are never decoded or copied.
+
+    Args:
+        source: frame source with `grab`, `retrieve` and `release` methods
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self._condition = threading.Condition()
+        self._wanted = False
+        self._image = None  # buffer of the requested frame
+        self._result = None
+        self._running = True
+        self.frame_index = -1  # index of the last delivered frame
+        self.grabbed_frames = 0
+        self._thread = threading.Thread(target=self._run, name='grabber', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            grabbed = self._source.grab()
+            with self._condition:
+                if not grabbed:
+                    self._running = False
+                    self._condition.notify_all()
+                    break
+                self.grabbed_frames += 1
+                if self._wanted:
+                    # retrieve on the grabbing thread, right after its grab
+                    self._wanted = False
+                    self._result = self._source.retrieve(self._image)
+                    self.frame_index = self.grabbed_frames - 1
+                    self._condition.notify_all()
+
+    @property
+    def skipped_frames(self) -> int:
+        """Frames grabbed but never delivered"""
+        return self.grabbed_frames - self.frame_index - 1
+
+    def read(self, image: np.ndarray = None) -> tuple[bool, np.ndarray]:
+        """Wait for the next grabbed frame and return it decoded
+
+        Args:
+            image (np.ndarray, optional): buffer to decode the frame into
+        """
+        with self._condition:
+            self._wanted = True
+            self._image = image
+            while self._result is None and self._running:
+                self._condition.wait()
+            result, self._result = self._result, None
+        return result if result is not None else (False, None)
+
+    def grab(self) -> bool:
+        # frames are grabbed by the thread
+        return self._running
+
+    def release(self):
+        self._running = False
+        self._thread.join()
+        self._source.release()
+
+
+def open_camera(camera_id: int) -> cv2.VideoCapture:
+    """Open a live camera with the configured frame size
+
+    Args:
+        camera_id (int): camera index
+
+    Returns:
+        cv2.VideoCapture: opened camera
+    """
+    camera = cv2.VideoCapture(camera_id, CAMERA_API)
+    camera.set(cv2.CAP_PROP_BUFFERSIZE, 0)
+    camera.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+    return camera
+
+
+def open_frame_source(
+    source: Union[int, str],
+    realtime: bool = REPLAY_REALTIME,
+    latest: bool = False,
+):
+    """Open a live camera or a recording to replay
+
+    Args:
+        source (int | str): camera index, video file or image directory
+        realtime (bool, optional): replay recordings at recorded speed,
+        otherwise as fast as possible. Defaults to `REPLAY_REALTIME`.
+        latest (bool, optional): deliver only the newest frame, see
+        `LatestFrameGrabber`. Defaults to False.
+
+    Returns:
+        frame source with `grab`, `retrieve`, `read` and `release` methods
+    """
+    if isinstance(source, int):
+        camera = open_camera(source)
+    elif latest and not realtime:
+        # unpaced, the grabber would run through the whole recording before
+        # the first frame is read
+        raise ValueError(f"'latest' sampling of {source} needs a realtime replay")
+    elif os.path.isdir(source):
+        camera = ImageDirSource(source, realtime)
+    else:
+        camera = VideoFileSource(source, realtime)
+    return LatestFrameGrabber(camera) if latest else camera
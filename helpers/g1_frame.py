@@ -0,0 +1,48 @@
+"""G1 instruction frame of the SEED S6H4D robot arm"""
+
+import struct
+
+# 48 bytes: head (238, '1', 1), X, Y, Z, J5, 4 unused bytes, J6, 16 unused
+# bytes, speed (IEEE 754 binary32, little-endian) and the tail (239)
+G1_FRAME = struct.Struct('<3B4f4xf16xfB')
+G1_HEAD = (238, ord('1'), 1)
+G1_TAIL = 239
+
+
+def encode_G1(
+    buffer: bytearray,
+    j6: float,
+    j5: float,
+    x: float,
+    y: float,
+    z: float,
+    speed: float,
+) -> bytearray:
+    """Pack a G1 instruction frame into a reusable buffer
+
+    Args:
+        buffer (bytearray): `G1_FRAME.size` bytes, overwritten
+        j6, j5, x, y, z (float): new position
+        speed (float): selected speed (mm/min)
+
+    Returns:
+        bytearray: the buffer
+    """
+    G1_FRAME.pack_into(buffer, 0, *G1_HEAD, x, y, z, j5, j6, speed, G1_TAIL)
+    return buffer
+
+
+def decode_G1(frame: bytes) -> tuple[float, float, float, float, float, float]:
+    """Unpack a G1 instruction frame
+
+    Args:
+        frame (bytes): `G1_FRAME.size` bytes
+
+    Returns:
+        tuple[float, float, float, float, float, float]: j6, j5, x, y, z and
+        speed (mm/min)
+    """
+    *head, x, y, z, j5, j6, speed, tail = G1_FRAME.unpack(frame)
+    if tuple(head) != G1_HEAD or tail != G1_TAIL:
+        raise ValueError(f"Not a G1 frame: {bytes(frame).hex()}")
+    return j6, j5, x, y, z, speed
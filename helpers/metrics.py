@@ -0,0 +1,250 @@
+"""Live metrics of the pipeline in the Prometheus text format
+
+Counters and histograms are accumulated per thread: every thread writing a
+series gets its own cells, which only it updates, and a scrape sums them.
+The hot path takes no lock and a scrape never blocks it:
+
+    FRAMES_PROCESSED.labels(camera_id).inc()
+    STAGE_SECONDS.labels(camera_id, 'track').observe(duration)
+
+Gauges are read from the running objects (queue depths, drop counts) only
+when scraped. `serve` exposes everything on `/metrics`.
+"""
+
+import bisect
+import http.server
+import threading
+from typing import Callable
+
+from config.metrics import LATENCY_BUCKETS, METRICS_HOST, METRICS_PORT
+
+REGISTRY = []  # metrics in the order they are exported
+
+
+class _Series:
+    """Cells of one labelled series, one list per writing thread"""
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._cells = []  # list.append is atomic
+
+    def _cell(self) -> list:
+        cell = getattr(self._local, 'cell', None)
+        if cell is None:
+            cell = self._local.cell = [0] * self._size
+            self._cells.append(cell)
+        return cell
+
+    def totals(self) -> list:
+        """Sum of every thread's cells"""
+        totals = [0] * self._size
+        for cell in list(self._cells):
+            for index, value in enumerate(cell):
+                totals[index] += value
+        return totals
+
+
+class _CounterSeries(_Series):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: float = 1):
+        self._cell()[0] += amount
+
+
+class _HistogramSeries(_Series):
+    def __init__(self, buckets: tuple):
+        super().__init__(len(buckets) + 2)  # buckets, +Inf, sum
+        self._buckets = buckets
+
+    def observe(self, value: float):
+        cell = self._cell()
+        cell[bisect.bisect_left(self._buckets, value)] += 1
+        cell[-1] += value
+
+
+class _Metric:
+    """Family of series with the same name, one per label values"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._series = {}
+        # a metric created again (e.g. a gauge of the next run) replaces the old one
+        REGISTRY[:] = [metric for metric in REGISTRY if metric.name != name]
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        """Series of the label values, created on first use"""
+        series = self._series.get(values)
+        if series is None:
+            series = self._series.setdefault(values, self._new_series())
+        return series
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def _format_labels(self, values: tuple, **extra) -> str:
+        pairs = list(zip(self.label_names, values)) + list(extra.items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+    def samples(self) -> list:
+        """Exposition lines of the metric"""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. processed frames"""
+
+    kind = 'counter'
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def samples(self):
+        return [
+            f'{self.name}{self._format_labels(values)} {series.totals()[0]}'
+            for values, series in list(self._series.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, e.g. stage latency (s)
+
+    Args:
+        buckets (tuple, optional): upper bounds. Defaults to
+        `LATENCY_BUCKETS`.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def samples(self):
+        lines = []
+        for values, series in list(self._series.items()):
+            *counts, total = series.totals()
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{self._format_labels(values, le=bound)} {cumulative}'
+                )
+            lines.append(f'{self.name}_sum{self._format_labels(values)} {total}')
+            lines.append(f'{self.name}_count{self._format_labels(values)} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Value read from the running objects when scraped
+
+    Args:
+        read (Callable): returns the value, or a dict label values -> value
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, read: Callable, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self.read = read
+
+    def samples(self):
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f'{self.name}{self._format_labels(key if isinstance(key, tuple) else (key,))} {value}'
+            for key, value in values.items()
+        ]
+
+
+def render() -> str:
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in list(REGISTRY):
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are not worth a line each
+
+
+def serve(host: str = METRICS_HOST, port: int = METRICS_PORT) -> http.server.HTTPServer:
+    """Serve `/metrics` from a daemon thread
+
+    Returns:
+        http.server.HTTPServer: the server, `shutdown()` stops it
+    """
+    server = http.server.ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+def watch(sync, writer, planner, segment=None):
+    """Export the queue depths and drop counts of the running pipeline
+
+    Args:
+        sync (CameraSync): results waiting for the robot loop, dropped ones
+        writer (SerialWriter): pending and dropped serial commands
+        planner (MotionPlanner): commands sent and held back
+        segment (InferenceService, optional): frames waiting for inference
+    """
+    Gauge(
+        'sync_pending_results',
+        "Camera results waiting for the robot loop",
+        lambda: sync.pending,
+    )
+    Gauge(
+        'sync_dropped_results',
+        "Camera results superseded before the robot loop took them",
+        lambda: dict(sync.dropped),
+        ('camera',),
+    )
+    Gauge('serial_pending_commands', "Commands waiting for the serial writer", lambda: writer.pending)
+    Gauge('serial_dropped_commands', "Commands replaced by newer ones", lambda: writer.dropped)
+    Gauge('planner_sent_commands', "Commands sent by the motion planner", lambda: planner.sent_commands)
+    Gauge('planner_held_commands', "Commands held back by the motion planner", lambda: planner.held_commands)
+    if segment is not None:
+        Gauge('inference_pending_frames', "Frames waiting for the shared inference", lambda: segment.pending)
+
+
+FRAMES_PROCESSED = Counter('pipeline_frames_processed_total', "Frames processed", ('camera',))
+FRAMES_SKIPPED = Counter(
+    'pipeline_frames_skipped_total', "Frames read past without processing", ('camera',)
+)
+FAILURES = Counter(
+    'pipeline_failures_total', "Frames failed in segmentation or tracking", ('camera', 'stage')
+)
+STAGE_SECONDS = Histogram(
+    'pipeline_stage_seconds', "Duration of a frame's stages", ('camera', 'stage')
+)
+SERIAL_WRITE_SECONDS = Histogram('serial_write_seconds', "Duration of a serial write")
+COMMAND_AGE_SECONDS = Histogram(
+    'robot_command_age_seconds', "Time from the frames' capture to the command"
+)
@@ -0,0 +1,25 @@
+"""Null robot connection: accepts and discards every command"""
+
+
+class NullConnection:
+    """Stand-in for `serial.Serial` when no robot is attached
+
+    Counts written frames and bytes, so benchmarks can check that commands
+    reached the connector.
+    """
+
+    def __init__(self):
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.is_open = True
+
+    def write(self, data: bytes) -> int:
+        self.frames_written += 1
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,162 @@
+"""Software stand-in for the SEED S6H4D robot arm on a pseudo-terminal
+
+The simulator owns the master side of a pty, the pipeline opens the slave
+side like the real serial port. Received G1 frames are decoded and executed
+one after another, each taking as long as the move at the commanded speed;
+when a move is finished its frame is echoed back as the acknowledgement.
+
+Linux/macOS only (pty). Run standalone and point the pipeline at it:
+
+    python3 -m helpers.robot_simulator
+    ROBOT_PORT=/dev/pts/N python3 main.py
+
+or set `ROBOT_PORT=sim` to start one inside the pipeline's process.
+"""
+
+import collections
+import math
+import os
+import select
+import threading
+import time
+from typing import NamedTuple
+
+from config.simulator import SIM_ACK, SIM_JOINT_SPEED, SIM_SETTLE_TIME
+from helpers.g1_frame import G1_FRAME, G1_HEAD, G1_TAIL, decode_G1
+
+
+class SimulatedMove(NamedTuple):
+    """One executed G1 command"""
+
+    position: tuple  # j6, j5, x, y, z
+    speed: float  # (mm/min)
+    received: float  # (perf_counter) when the frame arrived
+    start: float  # when the arm started moving
+    finish: float  # when the move was done (and acknowledged)
+
+
+class RobotSimulator:
+    """Simulated robot arm behind a pseudo-terminal
+
+    Args:
+        joint_speed (float, optional): (deg/s) joint speed. Defaults to
+        `SIM_JOINT_SPEED`.
+        settle_time (float, optional): (s) added to every move. Defaults to
+        `SIM_SETTLE_TIME`.
+        ack (bool, optional): echo finished frames. Defaults to `SIM_ACK`.
+    """
+
+    def __init__(
+        self,
+        joint_speed: float = SIM_JOINT_SPEED,
+        settle_time: float = SIM_SETTLE_TIME,
+        ack: bool = SIM_ACK,
+    ):
+        self.joint_speed = joint_speed
+        self.settle_time = settle_time
+        self.ack = ack
+        self.port = None  # path of the slave side, open it as ROBOT_PORT
+        self.position = None  # target of the last move
+        self.moves = []  # executed `SimulatedMove`s
+        self.invalid_bytes = 0  # skipped while looking for a frame head
+        self._busy_until = 0.0
+        self._acks = collections.deque()  # (finish, frame) not sent yet
+        self._master = self._slave = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Open the pseudo-terminal and start executing commands"""
+        import pty
+        import tty
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)  # never block on unread acks
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='robot_simulator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the simulator and close the pseudo-terminal"""
+        if self._thread is not None:
+            self._running = False
+            self._thread.join()
+            self._thread = None
+            os.close(self._master)
+            os.close(self._slave)
+
+    def duration(self, position: tuple, speed: float) -> float:
+        """(s) time to move from the current position"""
+        if self.position is None:
+            return self.settle_time
+        joints = max(abs(new - old) for new, old in zip(position[:2], self.position[:2]))
+        distance = math.dist(position[2:], self.position[2:])
+        linear = distance / (speed / 60) if speed > 0 else 0.0
+        return max(joints / self.joint_speed, linear) + self.settle_time
+
+    def execute(self, frame: bytes, received: float) -> SimulatedMove:
+        """Queue the move of a G1 frame after the previous one"""
+        *position, speed = decode_G1(frame)
+        start = max(received, self._busy_until)
+        finish = start + self.duration(position, speed)
+        self._busy_until = finish
+        self.position = tuple(position)
+        move = SimulatedMove(self.position, speed, received, start, finish)
+        self.moves.append(move)
+        if self.ack:
+            self._acks.append((finish, bytes(frame)))
+        return move
+
+    def _run(self):
+        buffer = bytearray()
+        while self._running:
+            # sleep until data arrives or the next move is finished
+            timeout = 0.1
+            if self._acks:
+                timeout = min(timeout, max(0.0, self._acks[0][0] - time.perf_counter()))
+            readable, _, _ = select.select([self._master], [], [], timeout)
+            now = time.perf_counter()
+
+            if readable:
+                try:
+                    buffer += os.read(self._master, 4096)
+                except BlockingIOError:
+                    pass
+                while len(buffer) >= G1_FRAME.size:
+                    # resynchronise on the frame head
+                    if tuple(buffer[:3]) != G1_HEAD or buffer[G1_FRAME.size - 1] != G1_TAIL:
+                        del buffer[0]
+                        self.invalid_bytes += 1
+                        continue
+                    self.execute(buffer[: G1_FRAME.size], now)
+                    del buffer[: G1_FRAME.size]
+
+            while self._acks and self._acks[0][0] <= now:
+                _, frame = self._acks.popleft()
+                try:
+                    os.write(self._master, frame)
+                except BlockingIOError:
+                    pass  # nobody reads the acknowledgements
+
+
+if __name__ == '__main__':
+    simulator = RobotSimulator()
+    simulator.start()
+    print(f"Simulated robot on {simulator.port}, stop with Ctrl+C")
+    try:
+        count = 0
+        while True:
+            time.sleep(0.5)
+            for move in simulator.moves[count:]:
+                print(
+                    f"J6 {move.position[0]:8.2f}  J5 {move.position[1]:8.2f}  "
+                    f"X {move.position[2]:8.2f}  Y {move.position[3]:8.2f}  "
+                    f"Z {move.position[4]:8.2f}  F {move.speed:6.0f}  "
+                    f"wait {move.start - move.received:6.3f} s  "
+                    f"move {move.finish - move.start:6.3f} s"
+                )
+            count = len(simulator.moves)
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,146 @@
+"""Shared-memory frame transport between camera processes and the main one
+
+Camera processes write model inputs into a `SharedRing`, the main process
+segments them and writes the masks into another one. Only slot numbers go
+through the (pickling) queues.
+"""
+
+import multiprocessing as mp
+import threading
+from multiprocessing import shared_memory
+from typing import Callable
+
+import numpy as np
+
+from config.model import NET_SIZE
+from config.runtime import PROCESS_START_METHOD, SHARED_RING_SLOTS
+
+CONTEXT = mp.get_context(PROCESS_START_METHOD)
+
+
+class SharedRing:
+    """Ring of equally shaped arrays in one shared memory block
+
+    Pickling a ring (e.g. as a `Process` argument) attaches to the same
+    block in the other process.
+
+    Args:
+        slots (int): number of arrays
+        shape (tuple): shape of one array
+        dtype (optional): data type. Defaults to float32.
+        name (str, optional): existing block to attach to. Defaults to None
+        (create a new one).
+    """
+
+    def __init__(self, slots: int, shape: tuple, dtype=np.float32, name: str = None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = slots * int(np.prod(shape)) * self.dtype.itemsize
+        self._memory = shared_memory.SharedMemory(
+            name=name, create=name is None, size=size if name is None else 0
+        )
+        self.array = np.ndarray((slots, *self.shape), self.dtype, buffer=self._memory.buf)
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def __getitem__(self, slot: int) -> np.ndarray:
+        return self.array[slot]
+
+    def __reduce__(self):
+        return SharedRing, (self.slots, self.shape, self.dtype, self.name)
+
+    def close(self):
+        """Detach this process from the block"""
+        self.array = None
+        self._memory.close()
+
+    def unlink(self):
+        """Free the block, called once by the creating process"""
+        self._memory.unlink()
+
+
+class SharedSegmentation:
+    """Segmentation as seen from a camera process
+
+    Called like the model, `segment(np.array([image]))`: the images go
+    through shared memory to the `SegmentationServer` of the main process,
+    which answers with the masks the same way.
+    """
+
+    def __init__(
+        self,
+        inputs: SharedRing,
+        masks: SharedRing,
+        requests: mp.Queue,
+        responses: mp.Queue,
+    ):
+        self.inputs = inputs
+        self.masks = masks
+        self.requests = requests
+        self.responses = responses
+        self._next_slot = 0
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        if len(batch) > self.inputs.slots:
+            raise ValueError(f"Batch of {len(batch)} does not fit {self.inputs.slots} slots")
+        slots = []
+        for image in batch:
+            slot = self._next_slot
+            self._next_slot = (slot + 1) % self.inputs.slots
+            self.inputs[slot].reshape(np.shape(image))[...] = image
+            self.requests.put(slot)
+            slots.append(slot)
+
+        for _ in slots:
+            response = self.responses.get()
+            if isinstance(response, str):  # the server failed
+                raise RuntimeError(f"Segmentation failed: {response}")
+        return np.stack([self.masks[slot].copy() for slot in slots])
+
+
+class SegmentationServer:
+    """Segment the images of one camera process in a thread of the main one
+
+    Several servers can share one `InferenceService` to batch the cameras.
+
+    Args:
+        segment (Callable): model or `InferenceService`
+        slots (int, optional): ring size. Defaults to `SHARED_RING_SLOTS`.
+    """
+
+    def __init__(self, segment: Callable, slots: int = SHARED_RING_SLOTS):
+        self.segment = segment
+        self.inputs = SharedRing(slots, NET_SIZE)
+        self.masks = SharedRing(slots, NET_SIZE)
+        self.requests, self.responses = CONTEXT.Queue(), CONTEXT.Queue()
+        self._thread = threading.Thread(target=self._run, name='segmentation', daemon=True)
+
+    def client(self) -> SharedSegmentation:
+        """Segmentation to pass to the camera process"""
+        return SharedSegmentation(self.inputs, self.masks, self.requests, self.responses)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and free the shared memory"""
+        self.requests.put(None)
+        self._thread.join()
+        for ring in (self.inputs, self.masks):
+            ring.close()
+            ring.unlink()
+
+    def _run(self):
+        while True:
+            slot = self.requests.get()
+            if slot is None:
+                break
+            try:
+                mask = np.asarray(self.segment(self.inputs[slot][np.newaxis]))[0]
+                self.masks[slot].reshape(mask.shape)[...] = mask
+                self.responses.put(slot)
+            except Exception as e:
+                self.responses.put(repr(e))
@@ -0,0 +1,23 @@
+"""Startup timing of the pipeline
+
+`START` is taken when this module is first imported, so entry points import
+it before anything heavy. Milestones are printed and kept in `TIMINGS`.
+"""
+
+import time
+
+START = time.perf_counter()
+TIMINGS = {}  # milestone -> (s) since `START`, or its own duration
+
+
+def mark(name: str, duration: float = None):
+    """Report a startup milestone
+
+    Args:
+        name (str): milestone
+        duration (float, optional): (s) duration to report instead of the
+        time since `START`
+    """
+    seconds = time.perf_counter() - START if duration is None else duration
+    TIMINGS[name] = seconds
+    print(f"STARTUP {name}: {seconds * 1000:.0f} ms")
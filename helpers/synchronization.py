@@ -0,0 +1,171 @@
+"""Latest-value exchange of the cameras' results with the robot loop
+
+Every camera pipeline puts `(rotation, x, y, confidence, timestamp)` of its
+processed frames, stamped with the frame's capture time (`perf_counter`).
+The robot loop takes the freshest result of every camera at once, so it
+never acts on motion that waited behind older results in a queue.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from typing import Iterable, Optional
+
+from config.runtime import SYNC_WINDOW
+
+
+class SyncChannel:
+    """Queue-like input of one camera, passed to `capture_frames`"""
+
+    def __init__(self, sync: 'CameraSync', camera_id: int):
+        self.sync = sync
+        self.camera_id = camera_id
+
+    def put(self, movement: tuple):
+        self.sync.put(self.camera_id, movement)
+
+
+class CameraSync:
+    """Pair the freshest results across cameras within a time window
+
+    A result that is not taken before the camera's next one is dropped, but
+    its motion is added to the next one: the increments are relative to the
+    previous frame, so losing them would make the robot drift. Drops are
+    counted per camera in `dropped`.
+
+    The window runs from the arrival of the first pending result, not from
+    its capture: processing takes longer than the window (e.g. segmentation
+    keyframes), which would otherwise expire before any pairing. The
+    capture time is only reported as the results' age.
+
+    Args:
+        camera_ids (Iterable[int]): cameras sending results
+        window (float, optional): (s) how long a result waits for the ones
+        of the other cameras. Defaults to `SYNC_WINDOW`.
+    """
+
+    def __init__(self, camera_ids: Iterable[int], window: float = SYNC_WINDOW):
+        self.window = window
+        self.active = set(camera_ids)  # cameras still sending results
+        self.dropped = dict.fromkeys(self.active, 0)
+        self.delivered = 0  # commands given to the robot loop
+        self._pending = {}  # camera ID -> [rotation, x, y, confidence, timestamp]
+        self._arrival = None  # (perf_counter) when the first pending result came
+        self._condition = threading.Condition()
+
+    @property
+    def pending(self) -> int:
+        """Cameras with a result waiting for `get`"""
+        return len(self._pending)
+
+    def channel(self, camera_id: int) -> SyncChannel:
+        """Input of the camera, used as its `movements` queue"""
+        return SyncChannel(self, camera_id)
+
+    def put(self, camera_id: int, movement: tuple):
+        """Store the camera's newest result
+
+        Args:
+            camera_id (int): camera
+            movement (tuple): rotation, x, y, confidence, capture timestamp;
+            all None when the camera stopped
+        """
+        with self._condition:
+            self._store(camera_id, movement)
+            self._condition.notify_all()
+
+    def get(self) -> Optional[tuple[dict, float]]:
+        """Wait for the next set of results
+
+        Returns once every active camera has a new result, or `window` after
+        the first pending one arrived.
+
+        Returns:
+            tuple[dict, float] | None: camera ID -> (rotation, x, y,
+            confidence), and the oldest capture timestamp among them;
+            None when all cameras stopped
+        """
+        with self._condition:
+            while True:
+                done, timeout = self._poll()
+                if done:
+                    return self._take()
+                self._condition.wait(timeout)
+
+    def _store(self, camera_id: int, movement: tuple):
+        if movement[0] is None:
+            self.active.discard(camera_id)
+        elif camera_id in self._pending:
+            rotation, x, y, confidence, timestamp = movement
+            pending = self._pending[camera_id]
+            pending[0] += rotation
+            pending[1] += x
+            pending[2] += y
+            pending[3] = min(pending[3], confidence)
+            pending[4] = timestamp
+            self.dropped[camera_id] += 1
+        else:
+            if not self._pending:
+                self._arrival = time.perf_counter()
+            self._pending[camera_id] = list(movement)
+
+    def _poll(self) -> tuple[bool, Optional[float]]:
+        """Whether `get` can return, otherwise how long to wait (s, None -
+        until the next result)"""
+        if not self._pending:
+            return not self.active, None
+        timeout = self._arrival + self.window - time.perf_counter()
+        return self.active <= self._pending.keys() or timeout <= 0, timeout
+
+    def _take(self) -> Optional[tuple[dict, float]]:
+        if not self._pending:
+            return None  # all cameras stopped
+        oldest = min(pending[4] for pending in self._pending.values())
+        estimates = {
+            camera_id: tuple(pending[:4])
+            for camera_id, pending in self._pending.items()
+        }
+        self._pending = {}
+        self.delivered += 1
+        return estimates, oldest
+
+
+class AsyncCameraSync(CameraSync):
+    """`CameraSync` for the asyncio runtime
+
+    `put` is called from the event loop and `get` is awaited.
+    """
+
+    def __init__(self, camera_ids: Iterable[int], window: float = SYNC_WINDOW):
+        super().__init__(camera_ids, window)
+        self._changed = asyncio.Event()
+
+    def put(self, camera_id: int, movement: tuple):
+        self._store(camera_id, movement)
+        self._changed.set()
+
+    async def get(self) -> Optional[tuple[dict, float]]:
+        while True:
+            done, timeout = self._poll()
+            if done:
+                return self._take()
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+def forward(movements: queue.Queue, channel: SyncChannel):
+    """Move the results of a camera process from its queue to the sync
+
+    Args:
+        movements (multiprocessing.Queue): results of the camera process
+        channel (SyncChannel): the camera's input
+    """
+    while True:
+        movement = movements.get()
+        channel.put(movement)
+        if movement[0] is None:
+            break
@@ -0,0 +1,187 @@
+"""Binary telemetry of a session: one fixed-width record per processed frame
+and per robot command
+
+Records go to a preallocated, memory-mapped NumPy structured array, so
+writing one is a slot reservation and a memory copy, with no formatting or
+file I/O on the calling thread. The file is a regular `.npy`:
+
+    records = load_telemetry('telemetry.npy')
+    frames = records[records['kind'] == FRAME]
+    frames['dx'], frames['timings'][:, STAGES.index('track')]
+"""
+
+import itertools
+from typing import Optional
+
+import numpy as np
+
+from config.telemetry import TELEMETRY_CAPACITY
+
+FRAME, COMMAND = 1, 2  # record kinds, 0 - never written
+STAGES = ('segmentation', 'crop', 'track', 'total')  # (s) per-frame timings
+
+TELEMETRY_DTYPE = np.dtype(
+    [
+        ('kind', 'u1'),
+        ('camera', 'i2'),  # -1 for robot commands
+        ('index', 'i8'),  # frame or command index
+        ('timestamp', 'f8'),  # (perf_counter) capture time of the frame(s)
+        ('box', 'i4', 4),  # wound row min/max, column min/max
+        ('keyframe', '?'),  # the frame was segmented
+        ('matches', 'i4'),  # -1 if the tracker does not match points
+        ('inliers', 'i4'),
+        ('confidence', 'f4'),
+        ('dx', 'f4'),  # (px)
+        ('dy', 'f4'),  # (px)
+        ('rotation', 'f4'),  # (deg)
+        ('scale', 'f4'),
+        ('command', 'f4', 5),  # commanded J6, J5 (deg), X, Y, Z (mm)
+        ('timings', 'f4', len(STAGES)),  # (s), for commands: capture to command
+    ]
+)
+
+
+class TelemetryRecorder:
+    """Append-only recorder, safe to call from several threads
+
+    Disabled (every call returns at once) until it is opened.
+
+    Args:
+        capacity (int, optional): records of the file. Defaults to
+        `TELEMETRY_CAPACITY`.
+    """
+
+    def __init__(self, capacity: int = TELEMETRY_CAPACITY):
+        self.capacity = capacity
+        self.records = None
+        self.dropped = 0  # records that did not fit
+        self._slots = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.records is not None
+
+    def open(self, path: str):
+        """Create the file and start recording"""
+        self.records = np.lib.format.open_memmap(
+            path, mode='w+', dtype=TELEMETRY_DTYPE, shape=(self.capacity,)
+        )
+        self._slots = itertools.count()  # `next` is atomic
+
+    def close(self):
+        """Flush the records to the file and stop recording"""
+        if self.records is not None:
+            self.records.flush()
+            self.records = None
+
+    def _slot(self) -> Optional[int]:
+        slot = next(self._slots)
+        if slot >= self.capacity:
+            self.dropped += 1
+            return None
+        return slot
+
+    def record_frame(
+        self,
+        camera: int,
+        index: int,
+        timestamp: float,
+        box: tuple[int, int, int, int],
+        keyframe: bool,
+        motion,
+        timings: tuple,
+    ):
+        """Record a processed frame
+
+        Args:
+            camera (int): camera ID
+            index (int): frame index
+            timestamp (float): (perf_counter) capture time
+            box (tuple[int, int, int, int]): wound bounding box
+            keyframe (bool): the frame was segmented
+            motion (TrackResult): tracked motion
+            timings (tuple): (s) duration of `STAGES`
+        """
+        records = self.records
+        if records is None:
+            return
+        slot = self._slot()
+        if slot is None:
+            return
+        matches = -1 if motion.matches is None else motion.matches
+        records[slot] = (
+            FRAME,
+            camera,
+            index,
+            timestamp,
+            box,
+            keyframe,
+            matches,
+            round(max(matches, 0) * motion.confidence),
+            motion.confidence,
+            motion.dx,
+            motion.dy,
+            motion.rotation,
+            motion.scale,
+            (0, 0, 0, 0, 0),
+            timings,
+        )
+
+    def record_command(
+        self,
+        index: int,
+        timestamp: float,
+        position: tuple,
+        latency: float,
+    ):
+        """Record a robot command
+
+        Args:
+            index (int): command index
+            timestamp (float): (perf_counter) capture time of its frames
+            position (tuple): commanded J6, J5, X, Y, Z
+            latency (float): (s) from the capture to the command
+        """
+        records = self.records
+        if records is None:
+            return
+        slot = self._slot()
+        if slot is None:
+            return
+        records[slot] = (
+            COMMAND,
+            -1,
+            index,
+            timestamp,
+            (0, 0, 0, 0),
+            False,
+            -1,
+            0,
+            0,
+            0,
+            0,
+            0,
+            0,
+            position,
+            (0, 0, 0, latency),
+        )
+
+
+def load_telemetry(path: str) -> np.ndarray:
+    """Records of a session
+
+    Args:
+        path (str): telemetry file
+
+    Returns:
+        np.ndarray: structured array of `TELEMETRY_DTYPE`, memory-mapped, in
+        the order they were reserved, up to the last written one (a slot
+        reserved but never written, e.g. in a crash, stays with kind 0)
+    """
+    records = np.load(path, mmap_mode='r')
+    written = np.flatnonzero(records['kind'])
+    # a slice keeps the memory map, a boolean filter would copy the records
+    return records[: written[-1] + 1 if len(written) else 0]
+
+
+TELEMETRY = TelemetryRecorder()
@@ -0,0 +1,153 @@
+"""Per-stage latency tracing of the pipeline
+
+Stages are wrapped into timed spans:
+
+    with span('segmentation'):
+        mask = segmentation(gray)
+
+Finished spans go to a ring buffer, tagged with the camera id and frame
+index set by `set_context` in the current thread, and can be dumped as a
+Chrome trace or JSON lines. When tracing is disabled `span` returns a shared
+no-op context manager, so the instrumentation can stay in the hot path.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+from config.tracing import TRACE_BUFFER_SIZE, TRACING_ENABLED
+
+
+class _NullSpan:
+    """Span that records nothing (tracing disabled)"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """Timed span, appended to the tracer's buffer on exit"""
+
+    __slots__ = ('tracer', 'name', 'start')
+
+    def __init__(self, tracer: 'Tracer', name: str):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        context = self.tracer._context
+        # deque.append is atomic, no lock is needed between threads
+        self.tracer.spans.append(
+            (
+                self.name,
+                getattr(context, 'camera', None),
+                getattr(context, 'frame', None),
+                threading.get_ident(),
+                self.start,
+                end - self.start,
+            )
+        )
+        return False
+
+
+class Tracer:
+    """Ring buffer of timed spans
+
+    Args:
+        enabled (bool, optional): record spans. Defaults to `TRACING_ENABLED`.
+        size (int, optional): number of spans to keep. Defaults to
+        `TRACE_BUFFER_SIZE`.
+    """
+
+    def __init__(self, enabled: bool = TRACING_ENABLED, size: int = TRACE_BUFFER_SIZE):
+        self.enabled = enabled
+        self.spans = collections.deque(maxlen=size)
+        self._context = threading.local()
+
+    def set_context(self, camera=None, frame: int = None):
+        """Tag the following spans of the current thread
+
+        Args:
+            camera (optional): camera id (or any other stream label)
+            frame (int, optional): frame (or command) index
+        """
+        if self.enabled:
+            self._context.camera = camera
+            self._context.frame = frame
+
+    def span(self, name: str):
+        """Context manager timing one stage
+
+        Args:
+            name (str): stage name
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def clear(self):
+        self.spans.clear()
+
+    def _events(self):
+        for name, camera, frame, thread, start, duration in list(self.spans):
+            yield {
+                'name': name,
+                'camera': camera,
+                'frame': frame,
+                'thread': thread,
+                'start_us': start / 1000,
+                'duration_us': duration / 1000,
+            }
+
+    def dump_json_lines(self, path: str):
+        """Write one JSON object per span"""
+        with open(path, 'w') as f:
+            for event in self._events():
+                f.write(json.dumps(event) + '\n')
+
+    def dump_chrome_trace(self, path: str):
+        """Write spans in the Chrome trace event format"""
+        pid = os.getpid()
+        events = [
+            {
+                'name': event['name'],
+                'cat': 'robot' if event['camera'] is None else f"camera {event['camera']}",
+                'ph': 'X',
+                'ts': event['start_us'],
+                'dur': event['duration_us'],
+                'pid': pid,
+                'tid': event['thread'],
+                'args': {'camera': event['camera'], 'frame': event['frame']},
+            }
+            for event in self._events()
+        ]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def dump(self, path: str):
+        """Write spans as JSON lines (`.jsonl`) or a Chrome trace (otherwise)"""
+        if path.endswith('.jsonl'):
+            self.dump_json_lines(path)
+        else:
+            self.dump_chrome_trace(path)
+
+
+### Process-wide tracer
+TRACER = Tracer()
+span = TRACER.span
+set_context = TRACER.set_context
@@ -1,8 +1,10 @@
 """Main image processing methods: finding shape, cropping ROI"""
 
+import math
+from typing import Callable, Optional
+
 import cv2
 import numpy as np
-from tensorflow import keras
 
 from config.camera import FRAME_HEIGHT, FRAME_WIDTH
 from config.model import (
@@ -12,83 +14,161 @@ from config.model import (
     THRESHOLD_STEP,
     ROI_BORDER,
 )
-from model.wound_segmentation import model
+from helpers.frame_pool import FramePool
+from helpers.tracing import span
+from model.backends import get_backend
 
 
-def segmentation(
+def _threshold_ladder() -> np.ndarray:
+    """Thresholds tried from `BASE_THRESHOLD` down to `MIN_THRESHOLD`"""
+    thresholds, threshold = [], BASE_THRESHOLD
+    while threshold > MIN_THRESHOLD:
+        thresholds.append(threshold)
+        threshold -= THRESHOLD_STEP
+    return np.array(thresholds)
+
+
+THRESHOLDS = _threshold_ladder()
+
+
+def prepare_input(
     gray: np.ndarray,
-    segment: keras.Model = model,
+    out: np.ndarray = None,
+    resized: np.ndarray = None,
+    img_size: tuple[int, int] = IMG_SIZE,
 ) -> np.ndarray:
-    """Find a wound in the image and segment it
+    """Resize and normalize a frame to the model input
 
     Args:
         gray (np.ndarray): frame in grayscale
-        segment (keras.Model, optional): segmentation model. Defaults to
-        `model`.
+        out (np.ndarray, optional): float32 buffer to write the input into.
+        Defaults to a new array.
+        resized (np.ndarray, optional): uint8 buffer for the resized frame.
+        Defaults to a new array.
+        img_size (tuple[int, int], optional): model input (width, height).
+        Defaults to `IMG_SIZE`.
 
     Returns:
-        np.ndarray: segmentation mask.
+        np.ndarray: model input image [0 ... 1], float32
     """
-    image = cv2.resize(gray, IMG_SIZE)  # resize image to march model input
-    image = image / 255  # normalize the image [0 ... 1]
-    mask = np.array(segment(np.array([image])))[0]  # predict segmentation mask
+    # resize image to match model input
+    resized = cv2.resize(gray, img_size, dst=resized)
+    # normalize the image [0 ... 1]
+    return np.divide(resized, np.float32(255), out=out, dtype=np.float32)
 
-    resized_mask = cv2.resize(
-        mask, (FRAME_HEIGHT, FRAME_WIDTH)
-    )  # return original dimensions
-    threshold = BASE_THRESHOLD  # initial threshold
 
-    # decrease the threshold until we find the mask or the threshold reaches 0.1
-    while threshold > MIN_THRESHOLD:
-        # pixel equals to 0 if it is lower than the threshold, 1 otherwise
-        filtered_mask = np.where(resized_mask > threshold)
+def mask_to_bbox(
+    mask: np.ndarray,
+    frame_shape: tuple[int, int] = (FRAME_HEIGHT, FRAME_WIDTH),
+) -> Optional[tuple[int, int, int, int]]:
+    """Bounding box of the mask, scaled to frame coordinates
+
+    The threshold is the highest one of `THRESHOLDS` below the mask's peak,
+    which is what lowering the threshold step by step until some pixel
+    passes it ends up with, found in one pass. The box is computed at model
+    resolution and only its corners are scaled up.
+
+    Args:
+        mask (np.ndarray): predicted probability map (H, W) or (H, W, 1)
+        frame_shape (tuple[int, int], optional): frame (height, width).
+        Defaults to (`FRAME_HEIGHT`, `FRAME_WIDTH`).
+
+    Returns:
+        tuple[int, int, int, int] | None: row min/max, column min/max (max
+        exclusive) in the frame, None if no pixel passes `MIN_THRESHOLD`
+    """
+    mask = mask.reshape(mask.shape[:2])
+    passed = THRESHOLDS < mask.max()
+    if not passed.any():
+        return None
+    binary = mask > THRESHOLDS[passed.argmax()]
+
+    rows = np.flatnonzero(binary.any(axis=1))
+    cols = np.flatnonzero(binary.any(axis=0))
+    row_scale = frame_shape[0] / mask.shape[0]
+    col_scale = frame_shape[1] / mask.shape[1]
+    return (
+        int(rows[0] * row_scale),
+        math.ceil((rows[-1] + 1) * row_scale),
+        int(cols[0] * col_scale),
+        math.ceil((cols[-1] + 1) * col_scale),
+    )
+
+
+def segmentation(
+    gray: np.ndarray,
+    segment: Callable = None,
+    pool: FramePool = None,
+) -> Optional[tuple[int, int, int, int]]:
+    """Find a wound in the image and return its bounding box
 
-        if len(filtered_mask[0]) == 0:  # if no pixel has value
-            threshold -= THRESHOLD_STEP  # decrease the threshold
-        else:
-            break  # otherwise return filtered_mask
-    return filtered_mask
+    Args:
+        gray (np.ndarray): frame in grayscale
+        segment (Callable, optional): segmentation model or anything called
+        like it (e.g. `InferenceService`). Defaults to the configured
+        inference backend.
+        pool (FramePool, optional): camera's buffers to prepare the model
+        input in. Defaults to new arrays.
+
+    Returns:
+        tuple[int, int, int, int] | None: wound bounding box in the frame
+        (see `mask_to_bbox`), None if no wound is found
+    """
+    if segment is None:
+        segment = get_backend()
+
+    if pool is None:
+        batch = prepare_input(gray)[np.newaxis]
+    else:
+        batch = pool.batch
+        prepare_input(gray, batch[0], pool.resized)
+    mask = np.asarray(segment(batch))[0]  # predict segmentation mask
+    return mask_to_bbox(mask, gray.shape[:2])
+
+
+def filter_ROI(roi: np.ndarray) -> np.ndarray:
+    """Apply Bilateral filter on the ROI (smooths while keeping edges)"""
+    with span('bilateral_filter'):
+        return cv2.bilateralFilter(roi, 10, 75, 750)
 
 
 def crop_ROI(
     gray: np.ndarray,
-    mask: np.ndarray,
-    roi_prev: np.ndarray = None,
-    gray_prev: np.ndarray = None,
+    roi: tuple[int, int, int, int],
+    roi_prev: tuple[int, int, int, int] = None,
     border: int = ROI_BORDER,
-    initial_run_flag: bool = False,
-):
-    """Crop ROI based on the segmented mask
+    crop: Callable = None,
+) -> tuple[np.ndarray, tuple[int, int, int, int]]:
+    """Crop ROI based on the segmented wound's bounding box
+
+    The crop covers the current and previous wound boxes, so the wound stays
+    inside it in both frames. Only the current frame is cropped and filtered,
+    the previous one is taken from `CameraState`.
 
     Args:
         gray (np.ndarray): current frame in grayscale
-        mask (np.ndarray): segmented wound mask
-        roi_prev (np.ndarray, optional): previous ROI coordinates
-        gray_prev (np.ndarray, optional): previous frame in grayscale
+        roi (tuple[int, int, int, int]): wound bounding box from
+        `segmentation` (row min/max, column min/max)
+        roi_prev (tuple[int, int, int, int], optional): previous wound
+        bounding box. Defaults to `roi` (initial run).
         border (int, optional): border around ROI (px). Defaults to
         `ROI_BORDER`.
-        initial_run_flag (bool, optional): points if now is the first
-        program run. Defaults to False.
+        crop (Callable, optional): cuts the crop box out of the frame, e.g.
+        `CameraCalibration.crop` undistorting it. Defaults to slicing.
 
     Returns:
-        cropped current and previous frames in grayscale, new ROI
-        coordinates
+        tuple[np.ndarray, tuple[int, int, int, int]]: filtered current ROI,
+        crop box (row min/max, column min/max)
     """
-    # find bounding box coordinates of the mask
-    xmin, xmax, ymin, ymax = mask[0].min(), mask[0].max(), mask[1].min(), mask[1].max()
+    if roi is None:
+        raise ValueError("No wound found in the frame")
+    # X runs along the frame rows, Y along the columns
+    xmin, xmax, ymin, ymax = roi
 
     # if it's an initial program run, set current values as previous ones
-    if not roi_prev:
-        initial_run_flag = True
-        roi_prev = xmin, xmax, ymin, ymax
-
+    if roi_prev is None:
+        roi_prev = roi
     xmin_previous, xmax_previous, ymin_previous, ymax_previous = roi_prev
-    roi_prev = (
-        xmin,
-        xmax,
-        ymin,
-        ymax,
-    )  # update previous coordinates with the new ROI
 
     # select min max values between current and previous masks
     min_x, max_x, min_y, max_y = (
@@ -102,30 +182,123 @@ def crop_ROI(
     if border:
         min_x, max_x, min_y, max_y = (
             max(0, min_x - border),
-            min(FRAME_WIDTH, max_x + border),
+            min(FRAME_HEIGHT, max_x + border),
             max(0, min_y - border),
-            min(FRAME_HEIGHT, max_y + border),
+            min(FRAME_WIDTH, max_y + border),
         )
 
-    # crop ROI on a current frame
-    cropped_gr = gray.copy()[
-        min_x:max_x,
-        min_y:max_y,
-    ]
+    # crop ROI on a current frame (a view, the filter writes a new array)
+    box = min_x, max_x, min_y, max_y
+    if crop is not None:
+        return filter_ROI(crop(gray, box)), box
+    return filter_ROI(gray[min_x:max_x, min_y:max_y]), box
 
-    # crop ROI on a previous frame
-    if initial_run_flag:
-        gray_prev = cropped_gr.copy()
-    else:
-        gray_prev = gray_prev.copy()[
-            min_x:max_x,
-            min_y:max_y,
-        ]
-    # apply Bilateral filter on both ROIs
+
+class CameraState:
+    """What one camera carries over from its previous processed frame
+
+    Every frame is filtered and its features are extracted once: the
+    filtered ROI, key points and descriptors of the current frame become the
+    previous ones of the next frame. Key points are kept in frame
+    coordinates, so they stay valid when the crop box moves.
+
+    Attributes:
+        gray (np.ndarray): previous frame in grayscale
+        wound (tuple): previous wound bounding box
+        box (tuple): crop box of `roi`
+        roi (np.ndarray): filtered ROI of the previous frame
+        points (np.ndarray): (N, 1, 2) key points (x, y) in the frame
+        descriptors (np.ndarray): descriptors of `points`
+        crop (Callable | None): cuts a crop box out of a frame, see `crop_ROI`
+    """
+
+    def __init__(self, gray: np.ndarray = None, crop: Callable = None):
+        self.gray = gray
+        self.crop = crop
+        self.wound = None
+        self.reset()
+
+    def reset(self):
+        """Drop the filtered ROI and the features, e.g. after a failed frame"""
+        self.box = None
+        self.roi = None
+        self.points = None
+        self.descriptors = None
+
+    def previous_roi(self, box: tuple[int, int, int, int]) -> np.ndarray:
+        """Filtered previous frame cropped to `box`
+
+        A view of the kept ROI if it covers `box`, otherwise the previous
+        frame is cropped and filtered again.
+
+        Args:
+            box (tuple[int, int, int, int]): crop box (row min/max, column
+            min/max)
+
+        Returns:
+            np.ndarray: filtered previous ROI
+        """
+        row_min, row_max, col_min, col_max = box
+        if self.roi is not None:
+            kept_row_min, kept_row_max, kept_col_min, kept_col_max = self.box
+            if (
+                kept_row_min <= row_min
+                and row_max <= kept_row_max
+                and kept_col_min <= col_min
+                and col_max <= kept_col_max
+            ):
+                return self.roi[
+                    row_min - kept_row_min : row_max - kept_row_min,
+                    col_min - kept_col_min : col_max - kept_col_min,
+                ]
+        if self.crop is not None:
+            return filter_ROI(self.crop(self.gray, box))
+        return filter_ROI(self.gray[row_min:row_max, col_min:col_max])
+
+    def update(
+        self,
+        gray: np.ndarray,
+        wound: tuple[int, int, int, int],
+        box: tuple[int, int, int, int],
+        roi: np.ndarray,
+    ):
+        """Keep the processed frame as the previous one
+
+        Trackers store the key points and descriptors themselves.
+        """
+        self.gray, self.wound, self.box, self.roi = gray, wound, box, roi
+
+
+def shift_ROI(
+    roi: tuple[int, int, int, int],
+    dx: float,
+    dy: float,
+    frame_shape: tuple[int, int] = (FRAME_HEIGHT, FRAME_WIDTH),
+) -> tuple[int, int, int, int]:
+    """Move the wound bounding box by the tracked displacement
+
+    Used instead of `segmentation` between keyframes. The box keeps its size
+    and stays inside the frame.
+
+    Args:
+        roi (tuple[int, int, int, int]): row min/max, column min/max
+        dx (float): (px) displacement along the columns
+        dy (float): (px) displacement along the rows
+        frame_shape (tuple[int, int], optional): frame (height, width).
+        Defaults to (`FRAME_HEIGHT`, `FRAME_WIDTH`).
+
+    Returns:
+        tuple[int, int, int, int]: shifted bounding box
+    """
+    row_min, row_max, col_min, col_max = roi
+    height, width = frame_shape
+    row_shift = min(max(round(dy), -row_min), height - row_max)
+    col_shift = min(max(round(dx), -col_min), width - col_max)
     return (
-        cv2.bilateralFilter(cropped_gr, 10, 75, 750),
-        cv2.bilateralFilter(gray_prev, 10, 75, 750),
-        roi_prev,
+        row_min + row_shift,
+        row_max + row_shift,
+        col_min + col_shift,
+        col_max + col_shift,
     )
 
 
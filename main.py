@@ -1,117 +1,220 @@
 """Run the system"""
 
+import asyncio
 import time
 import threading
-import queue
-
-from config.camera import BOTTOM_CAMERA_ID, TOP_CAMERA_ID
-from config.robot import CONN, HOME_J6, HOME_J5, HOME_X, HOME_Y, HOME_Z
-from robot_commands import homing, move_arm
-from vision_system import capture_frames
+from typing import Callable, Optional, Union
+
+import async_runtime
+from config.camera import CAMERAS
+from config.metrics import METRICS_ENABLED
+from config.model import BATCHED_INFERENCE
+from config.robot import (
+    HOME_J6,
+    HOME_J5,
+    HOME_X,
+    HOME_Y,
+    HOME_Z,
+    PREDICTION,
+)
+from config.runtime import EXECUTION_MODE, WARM_UP
+from config.telemetry import TELEMETRY_ENABLED, TELEMETRY_PATH
+from config.tracing import TRACE_PATH
+from fusion import MotionFusion
+from helpers import metrics
+from helpers.communication import WRITER, get_connection
+from helpers.shared_frames import CONTEXT, SegmentationServer
+from helpers.startup import mark
+from helpers.synchronization import CameraSync, SyncChannel, forward
+from helpers.telemetry import TELEMETRY
+from helpers.tracing import TRACER, span
+from model.backends import predict, preload
+from model.inference_service import InferenceService
+from prediction import MotionPredictor
+from robot_commands import PLANNER, homing, robot_step
+from vision_system import capture_frames, run_camera_process
 
 
 def manipulate_robot_arm(
-    top_cam_queue: queue.Queue,
-    btm_cam_queue: queue.Queue,
-    top_cam_event: threading.Event,
-    btm_cam_event: threading.Event,
+    sync: CameraSync,
     J6: float,
     J5: float,
     X: float,
     Y: float,
     Z: float,
+    fusion: MotionFusion = None,
+    predictor: MotionPredictor = None,
 ):
     """Robot arm manipulations.
 
     Args:
-        top_cam_queue (queue.Queue): results from top camera thread
-        btm_cam_queue (queue.Queue): results from bottom camera thread
-        top_cam_event (threading.Event): top camera's flag
-        btm_cam_event (threading.Event): bottom camera's flag
+        sync (CameraSync): freshest results of the cameras
         J6 (int): current J6 position
         J5 (int): current J5 position
         X (int):  current X position
         Y (int):  current Y position
         Z (int):  current Z position
+        fusion (MotionFusion, optional): combination of the cameras'
+        estimates. Defaults to the one of `CAMERAS`.
+        predictor (MotionPredictor, optional): latency compensation of the
+        fused motion. Defaults to None (apply the motion as measured).
     """
+    fusion = fusion or MotionFusion()
+    command_index = -1
+
     # endless loop, until the condition applies
     while True:
-        # wait for both events to be set
-        top_cam_event.wait()
-        btm_cam_event.wait()
-
-        # get frames from both queues
-        new_J6, new_x, new_y = top_cam_queue.get()
-        new_J5, _, new_z = btm_cam_queue.get()
-
-        # if queues return all None's, stop all the processes
-        if (new_J6 is None and new_x is None and new_y is None) and (
-            new_J5 is None and new_z is None
-        ):
+        # wait for the freshest results of the cameras
+        with span('sync_wait'):
+            results = sync.get()
+
+        # if all cameras stopped, stop all the processes
+        if results is None:
             time.sleep(10)  # wait 'till robot finishes the last movement
             homing()
-            CONN.close()  # close connector
+            WRITER.stop()  # write the pending commands
+            get_connection().close()  # close connector
             print("PRINTER STOPPED")
             break
+        estimates, capture_time = results
 
-        J6, J5, X, Y, Z = move_arm(new_J6, new_J5, new_x, new_y, new_z, J6, J5, X, Y, Z)
+        command_index += 1
+        J6, J5, X, Y, Z = robot_step(
+            estimates, capture_time, (J6, J5, X, Y, Z), command_index, fusion, predictor
+        )
 
-        # clear the events for the next iteration
-        top_cam_event.clear()
-        btm_cam_event.clear()
 
+def camera_worker(
+    camera_id: int,
+    channel: SyncChannel,
+    source: Union[int, str],
+    segment: Optional[Callable],
+    ready: threading.Event = None,
+    mode: str = EXECUTION_MODE,
+) -> tuple[list, Optional[SegmentationServer]]:
+    """Create the pipeline of one camera
 
-if __name__ == '__main__':
-    # initialise queue per camera. Each queue has 3 elements:
-    # 2D movement vector and rotation
-    top_cam_queue = queue.Queue(3)
-    btm_cam_queue = queue.Queue(3)
-
-    # initialise event flags per camera
-    top_cam_event = threading.Event()
-    btm_cam_event = threading.Event()
-
-    # initialise thread for the top camera
-    top_cam = threading.Thread(
-        target=capture_frames,
+    Args:
+        camera_id (int): current camera
+        channel (SyncChannel): the camera's input of the robot loop
+        source (int | str): camera index, recorded video or image directory
+        segment (Callable | None): shared segmentation, None - the default
+        model
+        ready (threading.Event, optional): set when the model is warmed up,
+        the camera threads start processing only then
+        mode (str, optional): "threads" or "processes". Defaults to
+        `EXECUTION_MODE`.
+
+    Returns:
+        tuple: threads and processes of the camera, and the segmentation
+        server it talks to (None for a thread)
+    """
+    if mode == 'threads':
+        worker = threading.Thread(
+            target=capture_frames,
+            args=(camera_id, channel),
+            kwargs=dict(
+                source=source,
+                segment=segment,
+                ready=ready,
+                commanded_z=PLANNER.commanded_z,
+            ),
+        )
+        return [worker], None
+
+    # the model stays in this process, the camera process sends its frames
+    # through shared memory and its results through a queue
+    server = SegmentationServer(segment or predict)
+    movements = CONTEXT.Queue()
+    worker = CONTEXT.Process(
+        target=run_camera_process,
         args=(
-            TOP_CAMERA_ID,
-            top_cam_queue,
-            top_cam_event,
+            camera_id,
+            movements,
+            server.client(),
+            dict(source=source, commanded_z=PLANNER.commanded_z),
         ),
+        name=f'camera{camera_id}',
     )
+    forwarder = threading.Thread(target=forward, args=(movements, channel))
+    return [worker, forwarder], server
+
+
+def run_threads():
+    """Run the cameras as threads (or processes) and the robot loop as a thread"""
+    # the robot takes the freshest result of every camera
+    sync = CameraSync(CAMERAS)
+
+    # load and warm up the model in the background while the cameras open
+    ready = preload(len(CAMERAS)) if WARM_UP else None
+
+    # share one batched segmentation worker between the cameras, a batch
+    # holds one frame per camera
+    segment = None
+    if BATCHED_INFERENCE:
+        segment = InferenceService(predict, max_batch_size=len(CAMERAS))
+        segment.start()
+
+    # initialise thread (or process) per camera
+    cameras, servers = [], []
+    for camera_id, settings in CAMERAS.items():
+        workers, server = camera_worker(
+            camera_id, sync.channel(camera_id), settings['source'], segment, ready
+        )
+        cameras.extend(workers)
+        if server is not None:
+            servers.append(server)
 
-    # initialise thread for the bottom camera
-    btm_cam = threading.Thread(
-        target=capture_frames,
-        args=(
-            BOTTOM_CAMERA_ID,
-            btm_cam_queue,
-            btm_cam_event,
-        ),
-    )
     # initialise thread for the robot
     robot = threading.Thread(
         target=manipulate_robot_arm,
         args=(
-            top_cam_queue,
-            btm_cam_queue,
-            top_cam_event,
-            btm_cam_event,
+            sync,
             HOME_J6,
             HOME_J5,
             HOME_X,
             HOME_Y,
             HOME_Z,
         ),
+        kwargs=dict(predictor=MotionPredictor() if PREDICTION else None),
     )
 
+    # counters and queue depths on http://METRICS_HOST:METRICS_PORT/metrics
+    metrics_server = None
+    if METRICS_ENABLED:
+        metrics.watch(sync, WRITER, PLANNER, segment)
+        metrics_server = metrics.serve()
+
     ### Start threads
-    top_cam.start()
-    btm_cam.start()
+    WRITER.start()  # serial writes never block the robot loop
+    for server in servers:
+        server.start()
+    for camera in cameras:
+        camera.start()
     robot.start()
+    mark('pipeline started')
 
     ### Finish threads
-    top_cam.join()
-    btm_cam.join()
+    for camera in cameras:
+        camera.join()
     robot.join()
+    for server in servers:
+        server.stop()
+    if segment is not None:
+        segment.stop()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    print(f"Dropped results per camera: {sync.dropped}")
+
+
+if __name__ == '__main__':
+    if TELEMETRY_ENABLED:
+        TELEMETRY.open(TELEMETRY_PATH)
+    if EXECUTION_MODE == 'asyncio':
+        asyncio.run(async_runtime.run())
+    else:
+        run_threads()
+
+    TELEMETRY.close()
+    if TRACER.enabled:
+        TRACER.dump(TRACE_PATH)
@@ -0,0 +1,265 @@
+"""Microbenchmarks of the hot-path functions with regression thresholds
+
+Times every stage of a frame on its own (median and p95 of `--repeat`
+calls) and measures its peak memory (`tracemalloc`, one call), across ROI
+sizes and feature counts. Frames are synthetic 1280x720 textures, or the
+first frames of a recording. Serial writes go to the null connection.
+
+Usage:
+    python3 microbenchmark.py [--recording RECORDING] [--repeat N]
+        [--only STAGE ...] [--json RESULTS] [--baseline BASELINE]
+        [--save-baseline] [--tolerance T]
+
+With `--baseline`, exits with status 1 if a case's median time or peak
+memory grows by more than `--tolerance` (relative) over the stored one, or
+if a stored case was not measured (use `--only` with a baseline of the same
+stages).
+"""
+
+import os
+
+# commands are written to a null connection, never to the robot
+os.environ['ROBOT_PORT'] = 'null'
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from typing import Callable, Iterator
+
+import cv2
+import numpy as np
+
+from config.camera import FRAME_HEIGHT, FRAME_WIDTH, SCALE
+from config.robot import HOME_Z, MEAN_SPEED
+from config.tracker import index_params, search_params
+from helpers.calibration import CameraCalibration
+from helpers.communication import send_message_G1
+from helpers.frame_pool import FramePool
+from helpers.frame_sources import open_frame_source
+from helpers.g1_frame import G1_FRAME, encode_G1
+from image_processing import convert_to_world_values, crop_ROI, segmentation
+from model.backends import predict
+from tracking import estimate_motion, track
+
+ROI_SIZES = (64, 128, 256, 512)  # (px) side of the square wound box
+FEATURE_COUNTS = (50, 100, 500)  # SIFT features
+MATCH_COUNTS = (10, 50, 200)  # point correspondences of `estimate_motion`
+SHIFT = 5, 3  # (px) displacement between the frames of a pair
+TOLERANCE = 0.2  # allowed relative growth over the baseline
+METRICS = {'median_ms': 'ms', 'peak_kib': 'KiB'}  # compared with the baseline
+
+
+def synthetic_frames() -> tuple[np.ndarray, np.ndarray]:
+    """Textured grayscale frame and the same one shifted by `SHIFT`"""
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, (FRAME_HEIGHT, FRAME_WIDTH), dtype=np.uint8)
+    previous = cv2.GaussianBlur(noise, (0, 0), 3)
+    current = np.roll(previous, SHIFT[::-1], axis=(0, 1))
+    return previous, current
+
+
+def recorded_frames(recording: str) -> tuple[np.ndarray, np.ndarray]:
+    """First two frames of a recording in grayscale"""
+    source = open_frame_source(recording, realtime=False)
+    frames = []
+    for _ in range(2):
+        retrieve, frame = source.read()
+        if not retrieve:
+            raise ValueError(f"Less than two frames in {recording}")
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    source.release()
+    return frames[0], frames[1]
+
+
+def centred_box(size: int) -> tuple[int, int, int, int]:
+    """Square wound box in the middle of the frame"""
+    row, col = (FRAME_HEIGHT - size) // 2, (FRAME_WIDTH - size) // 2
+    return row, row + size, col, col + size
+
+
+def measure(function: Callable, repeat: int) -> dict:
+    """Time (ms) and peak traced memory (KiB) of `function()`
+
+    The first call is a warm-up, memory is traced in a separate call so it
+    does not slow down the timed ones.
+    """
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = np.array(times) * 1000
+    return {
+        'median_ms': float(np.median(times)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'peak_kib': peak / 1024,
+    }
+
+
+def cases(previous: np.ndarray, current: np.ndarray) -> Iterator[tuple[str, str, Callable]]:
+    """Stage, case name and the call of every benchmark case"""
+    pool = FramePool()
+    yield 'segmentation', 'segmentation', lambda: segmentation(current, predict, pool)
+
+    for size in ROI_SIZES:
+        box = centred_box(size)
+        yield 'crop_ROI', f'crop_ROI[roi={size}]', lambda box=box: crop_ROI(current, box, box)
+
+    matcher = cv2.FlannBasedMatcher(index_params, search_params)
+    for size in ROI_SIZES:
+        for features in FEATURE_COUNTS:
+            roi_prev, box = crop_ROI(previous, centred_box(size))
+            roi_cur, _ = crop_ROI(current, centred_box(size))
+            detector = cv2.SIFT_create(nfeatures=features)
+            yield 'track', f'track[roi={size},features={features}]', (
+                lambda roi_prev=roi_prev, roi_cur=roi_cur, box=box, detector=detector: track(
+                    roi_cur, roi_prev, origin=(box[2], box[0]), detector=detector, matcher=matcher
+                )
+            )
+
+    rng = np.random.default_rng(0)
+    for matches in MATCH_COUNTS:
+        src_pnts = rng.uniform(0, 512, (matches, 1, 2)).astype(np.float32)
+        noise = rng.normal(0, 0.5, src_pnts.shape).astype(np.float32)
+        dst_pnts = src_pnts + np.float32(SHIFT) + noise
+        yield 'estimate_motion', f'estimate_motion[matches={matches}]', (
+            lambda src=src_pnts, dst=dst_pnts: estimate_motion(src, dst)
+        )
+
+    # a typical wide-angle lens, scale measured at two heights
+    calibration = CameraCalibration(
+        np.array([[1000.0, 0, FRAME_WIDTH / 2], [0, 1000.0, FRAME_HEIGHT / 2], [0, 0, 1]]),
+        np.array([-0.1, 0.01, 0, 0, 0]),
+        ((HOME_Z, SCALE), (HOME_Z + 100, SCALE * 2)),
+    )
+    for size in ROI_SIZES:
+        box = centred_box(size)
+        yield 'calibration', f'undistort_roi[roi={size}]', (
+            lambda box=box: calibration.crop(current, box)
+        )
+    for matches in MATCH_COUNTS:
+        points = rng.uniform(0, 512, (matches, 1, 2)).astype(np.float32)
+        yield 'calibration', f'undistort_points[matches={matches}]', (
+            lambda points=points: calibration.undistort_points(points)
+        )
+    yield 'calibration', 'scale_lookup', lambda: calibration.scale(HOME_Z + 12.3)
+
+    yield 'convert_to_world_values', 'convert_to_world_values', (
+        lambda: convert_to_world_values(*SHIFT, SCALE)
+    )
+
+    buffer = bytearray(G1_FRAME.size)
+    yield 'encode_G1', 'encode_G1', (
+        lambda: encode_G1(buffer, 0.0, 90.0, 0.0, 270.0, 100.0, MEAN_SPEED)
+    )
+
+    # the writer is not started: encodes and writes on the calling thread
+    yield 'send_message_G1', 'send_message_G1', (
+        lambda: send_message_G1(0.0, 90.0, 0.0, 270.0, 100.0, MEAN_SPEED)
+    )
+
+
+def run_microbenchmarks(
+    recording: str = None,
+    repeat: int = 50,
+    only: list = None,
+) -> dict:
+    """Measure every case
+
+    Args:
+        recording (str, optional): recorded video or image directory to take
+        the frames from. Defaults to synthetic frames.
+        repeat (int, optional): timed calls per case. Defaults to 50.
+        only (list, optional): stages to run. Defaults to all of them.
+
+    Returns:
+        dict: case name -> time and memory (see `measure`)
+    """
+    previous, current = recorded_frames(recording) if recording else synthetic_frames()
+    results = {}
+    for stage, name, function in cases(previous, current):
+        if only and stage not in only:
+            continue
+        try:
+            results[name] = measure(function, repeat)
+        except (ValueError, cv2.error) as e:
+            # e.g. too few features in a small ROI of a smooth recording
+            print(f"{name}: skipped ({e})")
+    return results
+
+
+def regressions(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    """Cases whose median time or peak memory exceeds the baseline by more
+    than `tolerance`, and baseline cases missing from the results
+
+    Returns:
+        list: (case name, metric, baseline value, current value), the current
+        value is None for a missing case
+    """
+    worse = []
+    for name, before in baseline.items():
+        result = results.get(name)
+        if result is None:
+            worse.append((name, 'median_ms', before['median_ms'], None))
+            continue
+        for metric in METRICS:
+            if result[metric] > before[metric] * (1 + tolerance):
+                worse.append((name, metric, before[metric], result[metric]))
+    return worse
+
+
+def print_report(results: dict):
+    print(f"{'case':<34}{'median ms':>11}{'p95 ms':>10}{'peak KiB':>10}")
+    for name, r in results.items():
+        print(f"{name:<34}{r['median_ms']:>11.3f}{r['p95_ms']:>10.3f}{r['peak_kib']:>10.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recording', help="take the frames from a video or image dir")
+    parser.add_argument('--repeat', type=int, default=50, help="timed calls per case")
+    parser.add_argument(
+        '--only',
+        nargs='+',
+        metavar='STAGE',
+        help="run only these stages (e.g. crop_ROI track)",
+    )
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="stored results to compare against")
+    parser.add_argument(
+        '--save-baseline',
+        action='store_true',
+        help="store the results as the --baseline instead of comparing",
+    )
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline needs --baseline")
+
+    results = run_microbenchmarks(args.recording, args.repeat, args.only)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            worse = regressions(results, json.load(f), args.tolerance)
+        for name, metric, before, now in worse:
+            if now is None:
+                print(f"MISSING {name}: in the baseline but not measured")
+            else:
+                print(f"REGRESSION {name}: {before:.3f} -> {now:.3f} {METRICS[metric]}")
+        sys.exit(1 if worse else 0)
@@ -0,0 +1,212 @@
+"""Inference backends of the wound segmentation model
+
+Every backend is a callable taking a batch of normalized grayscale images,
+(N, H, W) or (N, H, W, 1), and returning masks of shape (N, H, W, 1).
+Framework imports happen when a backend is loaded, so e.g. the ONNX
+backend runs without TensorFlow.
+"""
+
+import threading
+import time
+import traceback
+from typing import Callable
+
+import numpy as np
+
+from config.model import (
+    INFERENCE_BACKEND,
+    INFERENCE_THREADS,
+    NET_SIZE,
+    ONNX_MODEL_PATH,
+    TFLITE_MODEL_PATH,
+)
+from helpers.startup import mark
+
+
+def _as_input(batch: np.ndarray) -> np.ndarray:
+    """Convert a batch to float32 (N, H, W, 1)"""
+    batch = np.asarray(batch, dtype=np.float32)
+    if batch.ndim == 3:
+        batch = batch[..., np.newaxis]
+    return batch
+
+
+def load_keras() -> Callable:
+    """Eager Keras model (reference)"""
+    from model.wound_segmentation import load_model
+
+    return load_model()
+
+
+def load_tf_function() -> Callable:
+    """Keras model traced once into a graph with `tf.function`"""
+    import tensorflow as tf
+
+    from model.wound_segmentation import load_model
+
+    model = load_model()
+
+    @tf.function(input_signature=[tf.TensorSpec((None, *NET_SIZE), tf.float32)])
+    def predict(batch):
+        return model(batch, training=False)
+
+    def segment(batch: np.ndarray) -> np.ndarray:
+        return predict(_as_input(batch)).numpy()
+
+    return segment
+
+
+def load_onnx(path: str = ONNX_MODEL_PATH) -> Callable:
+    """Exported ONNX model run with onnxruntime
+
+    Args:
+        path (str, optional): exported model. Defaults to `ONNX_MODEL_PATH`.
+    """
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if INFERENCE_THREADS:
+        options.intra_op_num_threads = INFERENCE_THREADS
+    session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+
+    def segment(batch: np.ndarray) -> np.ndarray:
+        return session.run(None, {input_name: _as_input(batch)})[0]
+
+    return segment
+
+
+class TFLiteModel:
+    """Float16/int8-quantized TFLite model
+
+    Quantizes inputs and dequantizes outputs if the model has integer I/O.
+    The interpreter is not thread-safe, so calls are serialized.
+
+    Args:
+        path (str, optional): exported model. Defaults to `TFLITE_MODEL_PATH`.
+    """
+
+    def __init__(self, path: str = TFLITE_MODEL_PATH):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+
+        self._interpreter = Interpreter(model_path=path, num_threads=INFERENCE_THREADS)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = self._input['shape'][0]
+        self._lock = threading.Lock()
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        batch = _as_input(batch)
+        scale, zero_point = self._input['quantization']
+        if scale:
+            info = np.iinfo(self._input['dtype'])
+            batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+        batch = batch.astype(self._input['dtype'])
+
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input['index'], batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self._interpreter.set_tensor(self._input['index'], batch)
+            self._interpreter.invoke()
+            mask = self._interpreter.get_tensor(self._output['index'])
+
+        scale, zero_point = self._output['quantization']
+        if scale:
+            mask = (mask.astype(np.float32) - zero_point) * scale
+        return mask
+
+
+BACKENDS = {
+    'keras': load_keras,
+    'tf_function': load_tf_function,
+    'onnx': load_onnx,
+    'tflite': TFLiteModel,
+}
+
+
+def load_backend(name: str = INFERENCE_BACKEND) -> Callable:
+    """Load an inference backend
+
+    Args:
+        name (str, optional): one of `BACKENDS`. Defaults to
+        `INFERENCE_BACKEND`.
+
+    Returns:
+        Callable: model, takes a batch of images and returns their masks
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name!r}, use one of {list(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> Callable:
+    """Configured backend, loaded on the first call and shared afterwards"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = load_backend()
+    return _backend
+
+
+def predict(batch: np.ndarray) -> np.ndarray:
+    """Run the configured backend, called like the model
+
+    Loads the backend on the first call, so it can be handed to e.g.
+    `InferenceService` while the backend is still loading.
+    """
+    return get_backend()(batch)
+
+
+def warm_up(segment: Callable = predict, batch_size: int = 1):
+    """Run one inference on a blank batch
+
+    Loads the model and pays one-off costs (graph tracing, memory
+    allocation) before the first real frame.
+
+    Args:
+        segment (Callable, optional): model. Defaults to `predict`.
+        batch_size (int, optional): images in the batch. Defaults to 1.
+    """
+    segment(np.zeros((batch_size, *NET_SIZE), dtype=np.float32))
+
+
+def preload(batch_size: int = 1) -> threading.Event:
+    """Load and warm up the configured backend in a background thread
+
+    Args:
+        batch_size (int, optional): images in the warm-up batch. Defaults
+        to 1.
+
+    Returns:
+        threading.Event: set when the backend is ready (or failed to load,
+        the error is printed and raised again on the first inference)
+    """
+    ready = threading.Event()
+
+    def run():
+        try:
+            start = time.perf_counter()
+            get_backend()
+            mark('model loaded', time.perf_counter() - start)
+            start = time.perf_counter()
+            warm_up(batch_size=batch_size)
+            mark('model warm-up', time.perf_counter() - start)
+        except Exception as e:
+            print(f"ERROR : {e}  {traceback.format_exc()}")
+        finally:
+            ready.set()
+
+    threading.Thread(target=run, name='model_preload', daemon=True).start()
+    return ready
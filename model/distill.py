@@ -0,0 +1,157 @@
+"""Train a reduced model variant from the reference wound segmentation model
+
+The student (one of `MODEL_VARIANTS`) learns the reference model's soft
+masks on recorded frames, no labels are needed. A student of the reference
+depth starts from the reference weights pruned to its width: every
+convolution keeps the filters with the largest L1 norm.
+
+Usage:
+    python3 -m model.distill VARIANT RECORDING [RECORDING ...] [--frames N]
+        [--epochs E] [--batch-size B] [--output PATH]
+"""
+
+import argparse
+
+import cv2
+import numpy as np
+
+from config.model import MODEL_VARIANTS, VARIANT_MODEL_PATH
+from model.export import recorded_inputs
+from model.wound_segmentation import build_variant, load_model, unet_filters
+
+
+def prune_from(student, teacher, depth: int):
+    """Initialize the student's convolutions with the teacher's strongest filters
+
+    Both models have the same depth, their convolutions are created in the
+    same order (see `build_unet_model`): two per encoder level, two in the
+    bottleneck, two per decoder level and the output one.
+
+    Args:
+        student (keras.Model): reduced model, overwritten
+        teacher (keras.Model): reference model
+        depth (int): pooling levels of both
+    """
+    from tensorflow.keras import layers
+
+    convs = lambda model: [layer for layer in model.layers if isinstance(layer, layers.Conv2D)]
+    student_convs, teacher_convs = convs(student), convs(teacher)
+    encoder, _, _ = unet_filters(depth=depth)  # teacher's channels
+
+    kept = []  # output channels of every teacher convolution kept in the student
+    for index, (small, large) in enumerate(zip(student_convs, teacher_convs)):
+        kernel, bias = large.get_weights()
+        filters = small.filters
+
+        # input channels: the ones kept of the layer(s) feeding this one
+        if index == 0:
+            inputs = np.arange(kernel.shape[2])  # the image
+        elif index == len(teacher_convs) - 1 or index % 2 or index <= 2 * depth + 1:
+            inputs = kept[-1]  # previous convolution
+        else:
+            # first convolution of a decoder level: skip connection, then the
+            # upsampled previous level
+            level = depth - 1 - (index - 2 * depth - 2) // 2
+            skip = kept[2 * level + 1]
+            inputs = np.concatenate([skip, kept[-1] + encoder[level]])
+
+        strongest = np.argsort(-np.abs(kernel).sum(axis=(0, 1, 2)))[:filters]
+        outputs = np.sort(strongest)
+        kept.append(outputs)
+        small.set_weights([kernel[:, :, inputs][..., outputs], bias[outputs]])
+
+
+def distill(
+    variant: str,
+    recordings: list,
+    frames: int = 500,
+    epochs: int = 20,
+    batch_size: int = 16,
+    output: str = None,
+) -> dict:
+    """Train a variant on the reference model's masks and save its weights
+
+    Args:
+        variant (str): one of `MODEL_VARIANTS`, not the reference
+        recordings (list): recorded videos or image directories
+        frames (int, optional): max frames per recording. Defaults to 500.
+        epochs (int, optional): training epochs. Defaults to 20.
+        batch_size (int, optional): frames per step. Defaults to 16.
+        output (str, optional): weights file. Defaults to `VARIANT_MODEL_PATH`.
+
+    Returns:
+        dict: training history (loss per epoch)
+    """
+    from tensorflow import keras
+
+    if variant == 'reference':
+        raise ValueError("The reference model is not distilled")
+    settings = MODEL_VARIANTS[variant]
+    teacher = load_model(variant='reference')
+    student = build_variant(variant)
+    reference = MODEL_VARIANTS['reference']
+    if settings['depth'] == reference['depth'] and settings['width'] <= reference['width']:
+        prune_from(student, teacher, settings['depth'])
+
+    # teacher's masks at its input size, both resized to the student's
+    teacher_size = teacher.input_shape[1:3][::-1]
+    images = np.stack(
+        [
+            image
+            for recording in recordings
+            for image in recorded_inputs(recording, frames, teacher_size)
+        ]
+    )
+    if not len(images):
+        raise ValueError(f"No frames read from {recordings}")
+    masks = teacher.predict(images, batch_size=batch_size, verbose=0)
+    size = (settings['size'],) * 2
+    if size != teacher_size:
+        resize = lambda batch: np.stack(
+            [cv2.resize(item, size, interpolation=cv2.INTER_AREA) for item in batch]
+        )[..., np.newaxis]
+        images, masks = resize(images), resize(masks)
+
+    # a random tenth of the frames validates, split before the mirroring so
+    # no mirrored copy of a validation frame is trained on
+    order = np.random.default_rng(0).permutation(len(images))
+    validation, train = np.split(order, [len(order) // 10])
+    # mirrored frames double the training data, wounds have no preferred
+    # orientation
+    train_images = np.concatenate([images[train], images[train][:, :, ::-1]])
+    train_masks = np.concatenate([masks[train], masks[train][:, :, ::-1]])
+
+    student.compile(optimizer=keras.optimizers.Adam(1e-3), loss='binary_crossentropy')
+    history = student.fit(
+        train_images,
+        train_masks,
+        batch_size=batch_size,
+        epochs=epochs,
+        validation_data=(images[validation], masks[validation]) if len(validation) else None,
+        shuffle=True,
+        callbacks=[keras.callbacks.ReduceLROnPlateau(patience=3)],
+    )
+    student.save_weights(output or VARIANT_MODEL_PATH.format(variant))
+    return history.history
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        'variant', choices=[name for name in MODEL_VARIANTS if name != 'reference']
+    )
+    parser.add_argument('recordings', nargs='+', help="recorded videos or image directories")
+    parser.add_argument('--frames', type=int, default=500, help="max frames per recording")
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', help="weights file (default: VARIANT_MODEL_PATH)")
+    args = parser.parse_args()
+
+    distill(
+        args.variant,
+        args.recordings,
+        args.frames,
+        args.epochs,
+        args.batch_size,
+        args.output,
+    )
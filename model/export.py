@@ -0,0 +1,138 @@
+"""Export the wound segmentation model for the optimized inference backends
+
+The `tf_function` backend is traced from the checkpoint when it is loaded
+and needs no export.
+
+Usage:
+    python3 -m model.export onnx [--output PATH]
+    python3 -m model.export tflite --quantization float16
+    python3 -m model.export tflite --quantization int8 --calibration RECORDING
+"""
+
+import argparse
+from typing import Iterator
+
+import cv2
+import numpy as np
+
+from config.model import (
+    IMG_SIZE,
+    NET_SIZE,
+    ONNX_MODEL_PATH,
+    TFLITE_QUANTIZED_PATH,
+    TFLITE_QUANTIZATION,
+)
+from helpers.frame_sources import open_frame_source
+from image_processing import prepare_input
+
+
+def recorded_inputs(
+    recording: str,
+    count: int = 100,
+    img_size: tuple[int, int] = IMG_SIZE,
+) -> Iterator[np.ndarray]:
+    """Model inputs from a recorded video or image directory
+
+    Args:
+        recording (str): recorded video or image directory
+        count (int, optional): max number of frames. Defaults to 100.
+        img_size (tuple[int, int], optional): model input (width, height).
+        Defaults to `IMG_SIZE`.
+
+    Yields:
+        np.ndarray: float32 model input (H, W, 1)
+    """
+    source = open_frame_source(recording, realtime=False)
+    try:
+        for _ in range(count):
+            retrieve, frame = source.read()
+            if not retrieve:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            yield prepare_input(gray, img_size=img_size)[..., np.newaxis]
+    finally:
+        source.release()
+
+
+def export_onnx(path: str = ONNX_MODEL_PATH, opset: int = 13):
+    """Convert the Keras model to ONNX with a dynamic batch size
+
+    Args:
+        path (str, optional): output file. Defaults to `ONNX_MODEL_PATH`.
+        opset (int, optional): ONNX opset. Defaults to 13.
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    from model.wound_segmentation import load_model
+
+    model = load_model()
+
+    signature = (tf.TensorSpec((None, *NET_SIZE), tf.float32, name='image'),)
+    tf2onnx.convert.from_keras(
+        model, input_signature=signature, opset=opset, output_path=path
+    )
+
+
+def export_tflite(
+    path: str = None,
+    quantization: str = TFLITE_QUANTIZATION,
+    calibration: str = None,
+    samples: int = 100,
+):
+    """Convert the Keras model to a quantized TFLite model
+
+    Args:
+        path (str, optional): output file. Defaults to
+        `TFLITE_QUANTIZED_PATH` of the quantization.
+        quantization (str, optional): "float16" or "int8". Defaults to
+        `TFLITE_QUANTIZATION`.
+        calibration (str, optional): recording to calibrate int8 ranges on,
+        required for int8
+        samples (int, optional): calibration frames. Defaults to 100.
+    """
+    import tensorflow as tf
+
+    from model.wound_segmentation import load_model
+
+    model = load_model()
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if calibration is None:
+            raise ValueError("int8 quantization needs a calibration recording")
+        converter.representative_dataset = lambda: (
+            [image[np.newaxis]] for image in recorded_inputs(calibration, samples)
+        )
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    else:
+        raise ValueError(f"Unknown quantization {quantization!r}")
+
+    with open(path or TFLITE_QUANTIZED_PATH.format(quantization), 'wb') as f:
+        f.write(converter.convert())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('format', choices=('onnx', 'tflite'))
+    parser.add_argument('--output', help="output file (default: from config/model.py)")
+    parser.add_argument(
+        '--quantization', choices=('float16', 'int8'), default=TFLITE_QUANTIZATION
+    )
+    parser.add_argument('--calibration', help="recording for int8 calibration")
+    parser.add_argument('--samples', type=int, default=100)
+    args = parser.parse_args()
+
+    if args.format == 'onnx':
+        export_onnx(args.output or ONNX_MODEL_PATH)
+    else:
+        export_tflite(
+            args.output,
+            args.quantization,
+            args.calibration,
+            args.samples,
+        )
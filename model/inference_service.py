@@ -0,0 +1,134 @@
+"""Shared batched inference of the segmentation model for all cameras"""
+
+import queue
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+from config.model import BATCH_DEADLINE, MAX_BATCH_SIZE
+from helpers.tracing import span
+
+
+class _Request:
+    """One image waiting for its mask"""
+
+    __slots__ = ('image', 'mask', 'error', 'done')
+
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self.mask = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self) -> np.ndarray:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.mask
+
+
+class InferenceService:
+    """Single inference worker shared by all camera threads
+
+    Collects pending images from every caller, runs them through the model
+    as one batch and hands every caller back its own mask. A batch is closed
+    when it reaches `max_batch_size` images or `deadline` seconds after its
+    first image arrived.
+
+    The service is called like the model itself, `service(np.array([image]))`,
+    so it can be passed as `segment` to `segmentation`. Until it is started
+    (or after it is stopped) calls run the model directly.
+
+    Args:
+        segment (Callable): model, takes a batch of images and returns their
+        masks
+        max_batch_size (int, optional): images per batch. Defaults to
+        `MAX_BATCH_SIZE`.
+        deadline (float, optional): (s) max wait for a batch to fill. Defaults
+        to `BATCH_DEADLINE`.
+    """
+
+    def __init__(
+        self,
+        segment: Callable,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        deadline: float = BATCH_DEADLINE,
+    ):
+        self.segment = segment
+        self.max_batch_size = max_batch_size
+        self.deadline = deadline
+        self._requests = queue.Queue()
+        self._thread = None
+
+    @property
+    def pending(self) -> int:
+        """Frames waiting to be batched"""
+        return self._requests.qsize()
+
+    def start(self):
+        """Start the inference worker thread"""
+        self._thread = threading.Thread(target=self._run, name='inference', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Finish pending requests and stop the worker"""
+        if self._thread is not None:
+            self._requests.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        if self._thread is None:
+            return np.asarray(self.segment(batch))
+
+        requests = [_Request(image) for image in batch]
+        for request in requests:
+            self._requests.put(request)
+        return np.stack([request.wait() for request in requests])
+
+    def _collect(self) -> tuple[list, bool]:
+        """Block for the first request, then gather more until the deadline
+
+        Returns:
+            tuple[list, bool]: requests of the batch, whether to stop after it
+        """
+        first = self._requests.get()
+        if first is None:
+            return [], True
+
+        batch = [first]
+        deadline = time.perf_counter() + self.deadline
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            try:
+                with span('inference_batch'):
+                    masks = np.asarray(
+                        self.segment(np.stack([request.image for request in batch]))
+                    )
+                for request, mask in zip(batch, masks):
+                    request.mask = mask
+            except Exception as e:
+                # every caller of the failed batch gets the error
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
@@ -0,0 +1,89 @@
+"""Compare masks of an inference backend with the reference Keras model
+
+Usage:
+    python3 -m model.parity BACKEND RECORDING [--frames N] [--min-iou IOU]
+
+Exits with status 1 if any frame's thresholded mask overlaps the reference
+less than `--min-iou`.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from config.model import BASE_THRESHOLD
+from model.backends import BACKENDS, load_backend
+from model.export import recorded_inputs
+
+
+def mask_iou(mask_a: np.ndarray, mask_b: np.ndarray) -> float:
+    """Intersection over union of two binary masks (1.0 if both are empty)"""
+    union = np.logical_or(mask_a, mask_b).sum()
+    if not union:
+        return 1.0
+    return float(np.logical_and(mask_a, mask_b).sum() / union)
+
+
+def compare(
+    backend: str,
+    recording: str,
+    frames: int = 100,
+    threshold: float = BASE_THRESHOLD,
+) -> dict:
+    """Run the reference model and a backend on the same recorded frames
+
+    Args:
+        backend (str): backend to check, one of `BACKENDS`
+        recording (str): recorded video or image directory
+        frames (int, optional): number of frames. Defaults to 100.
+        threshold (float, optional): mask threshold. Defaults to
+        `BASE_THRESHOLD`.
+
+    Returns:
+        dict: probability differences, mask IoU and latency of both models
+    """
+    reference, candidate = load_backend('keras'), load_backend(backend)
+    diffs, ious, times_ref, times_cand = [], [], [], []
+
+    for image in recorded_inputs(recording, frames):
+        batch = image[np.newaxis]
+
+        start = time.perf_counter()
+        mask_ref = np.asarray(reference(batch))[0, ..., 0]
+        times_ref.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        mask_cand = np.asarray(candidate(batch))[0, ..., 0]
+        times_cand.append(time.perf_counter() - start)
+
+        diffs.append(np.abs(mask_ref - mask_cand))
+        ious.append(mask_iou(mask_ref > threshold, mask_cand > threshold))
+
+    if not ious:
+        raise ValueError(f"No frames read from {recording}")
+    return {
+        'frames': len(ious),
+        'max_abs_diff': float(max(d.max() for d in diffs)),
+        'mean_abs_diff': float(np.mean([d.mean() for d in diffs])),
+        'mean_iou': float(np.mean(ious)),
+        'min_iou': float(np.min(ious)),
+        'reference_ms': float(np.median(times_ref) * 1000),
+        'backend_ms': float(np.median(times_cand) * 1000),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('backend', choices=list(BACKENDS))
+    parser.add_argument('recording', help="recorded video or image directory")
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--threshold', type=float, default=BASE_THRESHOLD)
+    parser.add_argument('--min-iou', type=float, default=0.9)
+    args = parser.parse_args()
+
+    results = compare(args.backend, args.recording, args.frames, args.threshold)
+    for key, value in results.items():
+        print(f"{key:>14}: {value:.4f}" if isinstance(value, float) else f"{key:>14}: {value}")
+    sys.exit(0 if results['min_iou'] >= args.min_iou else 1)
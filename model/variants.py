@@ -0,0 +1,128 @@
+"""Compare the model variants' wound boxes and latency with the reference
+
+Every variant of `MODEL_VARIANTS` with trained weights segments the same
+recorded frames as the reference model. Reported per variant: parameters,
+convolution GFLOPs per frame, median latency (one frame) and the IoU of its
+wound bounding box with the reference one, which is what the tracking uses.
+The cheapest variant reaching `--min-iou` is suggested as `MODEL_VARIANT`.
+
+Usage:
+    python3 -m model.variants RECORDING [--frames N] [--variants NAME ...]
+        [--min-iou IOU] [--json RESULTS]
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from config.camera import FRAME_HEIGHT, FRAME_WIDTH
+from config.model import MODEL_PATH, MODEL_VARIANTS, VARIANT_MODEL_PATH
+from image_processing import mask_to_bbox
+from model.export import recorded_inputs
+from model.wound_segmentation import load_model
+
+
+def box_iou(box_a: tuple, box_b: tuple) -> float:
+    """Intersection over union of two wound boxes (1.0 if both are None)"""
+    if box_a is None or box_b is None:
+        return float(box_a is box_b)
+    rows = min(box_a[1], box_b[1]) - max(box_a[0], box_b[0])
+    cols = min(box_a[3], box_b[3]) - max(box_a[2], box_b[2])
+    intersection = max(rows, 0) * max(cols, 0)
+    area = lambda box: (box[1] - box[0]) * (box[3] - box[2])
+    union = area(box_a) + area(box_b) - intersection
+    return intersection / union if union else 1.0
+
+
+def conv_gflops(model) -> float:
+    """Multiply-adds (x2) of the model's convolutions for one frame"""
+    from tensorflow.keras import layers
+
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, layers.Conv2D):
+            _, height, width, channels = layer.output.shape
+            kernel_height, kernel_width, inputs, _ = layer.kernel.shape
+            flops += 2 * height * width * channels * kernel_height * kernel_width * inputs
+    return flops / 1e9
+
+
+def compare_variants(recording: str, frames: int = 100, variants: list = None) -> dict:
+    """Segment recorded frames with every variant and the reference
+
+    Args:
+        recording (str): recorded video or image directory
+        frames (int, optional): number of frames. Defaults to 100.
+        variants (list, optional): variants to compare. Defaults to all of
+        `MODEL_VARIANTS` with trained weights.
+
+    Returns:
+        dict: variant -> parameters, GFLOPs, latency and wound box IoU
+    """
+    frame_shape = FRAME_HEIGHT, FRAME_WIDTH
+    results, references = {}, None
+    # the reference boxes come first
+    names = ['reference'] + [name for name in variants or MODEL_VARIANTS if name != 'reference']
+    for variant in names:
+        path = MODEL_PATH if variant == 'reference' else VARIANT_MODEL_PATH.format(variant)
+        if not os.path.exists(path):
+            if variant == 'reference':
+                raise FileNotFoundError(f"No reference weights in {path}")
+            print(f"{variant}: no weights in {path}, distill it with model.distill")
+            continue
+        model = load_model(variant=variant)
+        size = model.input_shape[1:3][::-1]
+        boxes, times = [], []
+        for image in recorded_inputs(recording, frames, size):
+            start = time.perf_counter()
+            mask = np.asarray(model(image[np.newaxis], training=False))[0]
+            times.append(time.perf_counter() - start)
+            boxes.append(mask_to_bbox(mask, frame_shape))
+        if not boxes:
+            raise ValueError(f"No frames read from {recording}")
+        if references is None:
+            references = boxes
+        if variants and variant not in variants:
+            continue
+
+        ious = [box_iou(box, reference) for box, reference in zip(boxes, references)]
+        results[variant] = {
+            'params': model.count_params(),
+            'gflops': conv_gflops(model),
+            'latency_ms': float(np.median(times[1:] or times) * 1000),  # w/o warm-up
+            'mean_box_iou': float(np.mean(ious)),
+            'min_box_iou': float(np.min(ious)),
+        }
+    return results
+
+
+def select_variant(results: dict, min_iou: float) -> str:
+    """Fastest variant whose mean wound box IoU reaches `min_iou`"""
+    passing = [name for name, r in results.items() if r['mean_box_iou'] >= min_iou]
+    return min(passing, key=lambda name: results[name]['latency_ms'], default='reference')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('recording', help="recorded video or image directory")
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--variants', nargs='+', choices=list(MODEL_VARIANTS))
+    parser.add_argument('--min-iou', type=float, default=0.8)
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+
+    results = compare_variants(args.recording, args.frames, args.variants)
+    print(f"{'variant':<18}{'params':>10}{'GFLOPs':>9}{'ms':>9}{'mean IoU':>10}{'min IoU':>9}")
+    for name, r in results.items():
+        print(
+            f"{name:<18}{r['params']:>10}{r['gflops']:>9.2f}{r['latency_ms']:>9.2f}"
+            f"{r['mean_box_iou']:>10.3f}{r['min_box_iou']:>9.3f}"
+        )
+    cheapest = select_variant(results, args.min_iou)
+    print(f"cheapest variant with mean box IoU >= {args.min_iou}: {cheapest}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
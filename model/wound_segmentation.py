@@ -6,90 +6,110 @@ np.object = object
 np.bool = bool
 np.int = int
 
-from config.model import MODEL_PATH, NET_SIZE
+from config.model import MODEL_PATH, MODEL_VARIANT, MODEL_VARIANTS, VARIANT_MODEL_PATH
 from tensorflow import keras
 from tensorflow.keras import layers
 
 
-def build_unet_model(input_shape: tuple[int, int, int]) -> keras.Model:
+def _conv_block(x, filters: int):
+    """Two 3x3 convolutions with ReLU"""
+    for _ in range(2):
+        x = layers.Conv2D(
+            filters, 3, activation='relu', kernel_initializer='he_normal', padding='same'
+        )(x)
+    return x
+
+
+def unet_filters(width: float = 1.0, depth: int = 3) -> tuple[list, int, list]:
+    """Channels of the encoder levels, the bottleneck and the decoder levels
+
+    The reference U-Net (width 1, depth 3) has 64, 128, 256 channels in the
+    encoder, 512 in the bottleneck and 256, 128, 128 in the decoder (its
+    last level keeps 128 channels).
+
+    Args:
+        width (float, optional): multiplier of every level's channels.
+        Defaults to 1.0.
+        depth (int, optional): pooling levels. Defaults to 3.
+
+    Returns:
+        tuple[list, int, list]: encoder (top down), bottleneck, decoder
+        (bottom up)
+    """
+    scaled = lambda level: max(1, round(64 * 2**level * width))
+    encoder = [scaled(level) for level in range(depth)]
+    decoder = [scaled(max(level, 1)) for level in reversed(range(depth))]
+    return encoder, scaled(depth), decoder
+
+
+def build_unet_model(
+    input_shape: tuple[int, int, int],
+    width: float = 1.0,
+    depth: int = 3,
+) -> keras.Model:
     """Initialize model
 
-    U-Net model architecture.
+    U-Net model architecture. The defaults build the reference model, the
+    layers are created in the same order for every variant.
 
     Args:
         input_shape (tuple[int, int, int]): input image size (height,
         width, channels)
+        width (float, optional): multiplier of every level's channels.
+        Defaults to 1.0.
+        depth (int, optional): pooling levels. Defaults to 3.
 
     Returns:
         keras.Model: wound segmentation model
     """
+    encoder, bottleneck, decoder = unet_filters(width, depth)
     inputs = keras.Input(shape=input_shape)
 
     # Encoder
-    conv1 = layers.Conv2D(
-        64, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(inputs)
-    conv1 = layers.Conv2D(
-        64, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(conv1)
-    pool1 = layers.MaxPooling2D(pool_size=(2, 2))(conv1)
-
-    conv2 = layers.Conv2D(
-        128, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(pool1)
-    conv2 = layers.Conv2D(
-        128, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(conv2)
-    pool2 = layers.MaxPooling2D(pool_size=(2, 2))(conv2)
-
-    conv3 = layers.Conv2D(
-        256, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(pool2)
-    conv3 = layers.Conv2D(
-        256, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(conv3)
-    pool3 = layers.MaxPooling2D(pool_size=(2, 2))(conv3)
+    x, skips = inputs, []
+    for filters in encoder:
+        x = _conv_block(x, filters)
+        skips.append(x)
+        x = layers.MaxPooling2D(pool_size=(2, 2))(x)
 
     # Bottleneck
-    conv4 = layers.Conv2D(
-        512, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(pool3)
-    conv4 = layers.Conv2D(
-        512, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(conv4)
+    x = _conv_block(x, bottleneck)
 
     # Decoder
-    up1 = layers.UpSampling2D((2, 2))(conv4)
-    concat1 = layers.Concatenate(axis=-1)([conv3, up1])
-    conv5 = layers.Conv2D(
-        256, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(concat1)
-    conv5 = layers.Conv2D(
-        256, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(conv5)
-    up2 = layers.UpSampling2D((2, 2))(conv5)
-
-    concat2 = layers.Concatenate(axis=-1)([conv2, up2])
-    conv6 = layers.Conv2D(
-        128, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(concat2)
-    conv6 = layers.Conv2D(
-        128, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(conv6)
-    up3 = layers.UpSampling2D((2, 2))(conv6)
-
-    concat3 = layers.Concatenate(axis=-1)([conv1, up3])
-    conv7 = layers.Conv2D(
-        128, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(concat3)
-    conv7 = layers.Conv2D(
-        128, 3, activation='relu', kernel_initializer='he_normal', padding='same'
-    )(conv7)
-
-    outputs = layers.Conv2D(1, 1, activation='sigmoid')(conv7)
+    for filters, skip in zip(decoder, reversed(skips)):
+        up = layers.UpSampling2D((2, 2))(x)
+        x = layers.Concatenate(axis=-1)([skip, up])
+        x = _conv_block(x, filters)
+
+    outputs = layers.Conv2D(1, 1, activation='sigmoid')(x)
     return keras.Model(inputs=inputs, outputs=outputs)
 
 
-### Loading the wound segmentation model
-model = build_unet_model(NET_SIZE)  # trained model size
-model.load_weights(MODEL_PATH)
+def build_variant(variant: str = MODEL_VARIANT) -> keras.Model:
+    """Untrained model of one of `MODEL_VARIANTS`"""
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown model variant {variant!r}, use one of {list(MODEL_VARIANTS)}")
+    settings = MODEL_VARIANTS[variant]
+    size = settings['size']
+    if size % 2 ** settings['depth']:
+        raise ValueError(f"Input size {size} of {variant!r} is not divisible by 2 ** depth")
+    return build_unet_model((size, size, 1), settings['width'], settings['depth'])
+
+
+def load_model(path: str = None, variant: str = MODEL_VARIANT) -> keras.Model:
+    """Load the wound segmentation model
+
+    Args:
+        path (str, optional): trained weights. Defaults to `MODEL_PATH` for
+        the reference model, else the distilled `VARIANT_MODEL_PATH`.
+        variant (str, optional): one of `MODEL_VARIANTS`. Defaults to
+        `MODEL_VARIANT`.
+
+    Returns:
+        keras.Model: wound segmentation model
+    """
+    model = build_variant(variant)
+    if path is None:
+        path = MODEL_PATH if variant == 'reference' else VARIANT_MODEL_PATH.format(variant)
+    model.load_weights(path)
+    return model
@@ -0,0 +1,101 @@
+"""Latency compensation of the fused motion"""
+
+import time
+from typing import Optional
+
+import numpy as np
+
+from config.robot import (
+    AXES,
+    PREDICTOR_EXECUTION_DELAY,
+    PREDICTOR_MEASUREMENT_NOISE,
+    PREDICTOR_PROCESS_NOISE,
+)
+
+
+class MotionPredictor:
+    """Constant-velocity Kalman filter per axis
+
+    The filter tracks the surface's position (the sum of the measured
+    increments) and velocity on every axis, timestamped with the frames'
+    capture time. A command targets the position extrapolated to when the
+    arm will act on it: the measured capture to command latency plus
+    `execution_delay`.
+
+    Args:
+        process_noise (dict, optional): axis -> acceleration noise. Defaults
+        to `PREDICTOR_PROCESS_NOISE`.
+        measurement_noise (dict, optional): axis -> measurement variance.
+        Defaults to `PREDICTOR_MEASUREMENT_NOISE`.
+        execution_delay (float, optional): (s) from sending a command to its
+        execution. Defaults to `PREDICTOR_EXECUTION_DELAY`.
+    """
+
+    def __init__(
+        self,
+        process_noise: dict = PREDICTOR_PROCESS_NOISE,
+        measurement_noise: dict = PREDICTOR_MEASUREMENT_NOISE,
+        execution_delay: float = PREDICTOR_EXECUTION_DELAY,
+    ):
+        self.q = np.array([process_noise[axis] for axis in AXES])
+        self.r = np.array([measurement_noise[axis] for axis in AXES])
+        self.execution_delay = execution_delay
+        self.reset()
+
+    def reset(self):
+        """Forget the tracked motion"""
+        self.state = np.zeros((len(AXES), 2))  # position, velocity per axis
+        self.covariance = None  # (axes, 2, 2)
+        self.measured = np.zeros(len(AXES))  # sum of the measured increments
+        self.commanded = np.zeros(len(AXES))  # sum of the returned increments
+        self.time = None  # capture time of the last measurement
+
+    def _predict(self, dt: float):
+        """Move the state `dt` seconds forward"""
+        self.state[:, 0] += self.state[:, 1] * dt
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = np.array([[dt**3 / 3, dt**2 / 2], [dt**2 / 2, dt]])
+        self.covariance = F @ self.covariance @ F.T + self.q[:, None, None] * Q
+
+    def __call__(
+        self,
+        increments: tuple,
+        capture_time: float,
+        now: Optional[float] = None,
+    ) -> tuple[float, float, float, float, float]:
+        """Filter the next measured motion
+
+        Args:
+            increments (tuple): J6, J5, X, Y, Z measured since the last call
+            capture_time (float): (perf_counter) capture time of the frames
+            now (float, optional): (perf_counter) current time. Defaults to
+            `time.perf_counter()`.
+
+        Returns:
+            tuple[float, float, float, float, float]: J6, J5, X, Y, Z to add
+        """
+        now = time.perf_counter() if now is None else now
+        self.measured += increments
+
+        if self.covariance is None:
+            # start at the measurement, with an unknown velocity
+            self.state[:, 0] = self.measured
+            self.covariance = np.zeros((len(AXES), 2, 2))
+            self.covariance[:, 0, 0] = self.r
+            self.covariance[:, 1, 1] = 1e3
+        else:
+            dt = capture_time - self.time
+            if dt > 0:
+                self._predict(dt)
+            # measurement update, only the position is observed
+            residual = self.measured - self.state[:, 0]
+            gain = self.covariance[:, :, 0] / (self.covariance[:, 0, 0] + self.r)[:, None]
+            self.state += gain * residual[:, None]
+            self.covariance -= gain[:, :, None] * self.covariance[:, None, 0, :]
+        self.time = capture_time if self.time is None else max(self.time, capture_time)
+
+        lead = now - capture_time + self.execution_delay
+        target = self.state[:, 0] + self.state[:, 1] * lead
+        increments = target - self.commanded
+        self.commanded = target
+        return tuple(float(value) for value in increments)
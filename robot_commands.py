@@ -1,17 +1,117 @@
 """Main robot commands: home, move"""
 
+import asyncio
+import math
 import time
 
 from config.robot import (
+    AXES,
+    DEADBAND,
     HOME_J6,
     HOME_J5,
     HOME_X,
     HOME_Y,
     HOME_Z,
     HOME_SPEED,
+    MAX_COMMAND_RATE,
     MEAN_SPEED,
+    WORKSPACE,
 )
+from fusion import MotionFusion
 from helpers.communication import send_message_G1
+from helpers.metrics import COMMAND_AGE_SECONDS
+from helpers.shared_frames import CONTEXT
+from helpers.telemetry import TELEMETRY
+from helpers.tracing import set_context, span
+from prediction import MotionPredictor
+
+
+class MotionPlanner:
+    """Decides which positions are sent to the robot
+
+    A position is held back while it is within the deadband of the last sent
+    one, or while the last move is still in flight (at least
+    1 / `max_rate` s, longer for long moves at the given speed). Held back
+    positions are not lost: the caller keeps accumulating its increments, so
+    the next sent position contains them.
+
+    Args:
+        deadband (dict, optional): axis -> smallest move. Defaults to
+        `DEADBAND`.
+        max_rate (float, optional): (Hz) max commands per second. Defaults to
+        `MAX_COMMAND_RATE`.
+        workspace (dict, optional): axis -> (min, max) reachable position.
+        Defaults to `WORKSPACE`.
+    """
+
+    def __init__(
+        self,
+        deadband: dict = DEADBAND,
+        max_rate: float = MAX_COMMAND_RATE,
+        workspace: dict = WORKSPACE,
+    ):
+        self.deadband = tuple(deadband[axis] for axis in AXES)
+        self.min_interval = 1 / max_rate
+        self.workspace = tuple(workspace[axis] for axis in AXES)
+        self.sent = None  # last sent position
+        # its Z, shared with the camera pipelines (also in other processes)
+        # for the scale lookup; the robot starts at home
+        self.commanded_z = CONTEXT.RawValue('d', HOME_Z)
+        self.busy_until = 0.0  # (perf_counter) end of the last move
+        self.sent_commands = 0
+        self.held_commands = 0
+
+    def clamp(self, position: tuple) -> tuple:
+        """Clamp a position into the workspace envelope"""
+        return tuple(
+            min(max(value, low), high)
+            for value, (low, high) in zip(position, self.workspace)
+        )
+
+    def reset(self, position: tuple):
+        """Position sent outside of the planner, e.g. by `homing`"""
+        self.sent = tuple(position)
+        self.commanded_z.value = self.sent[4]
+        self.busy_until = 0.0
+
+    def move_duration(self, position: tuple, speed: float) -> float:
+        """(s) estimated time to move the linear axes from the last sent
+        position"""
+        if self.sent is None:
+            return 0.0
+        return math.dist(position[2:], self.sent[2:]) / (speed / 60)
+
+    def submit(self, position: tuple, speed: float) -> bool:
+        """Send the position unless it is held back
+
+        Args:
+            position (tuple): J6, J5, X, Y, Z within the workspace
+            speed (float): selected speed (mm/min)
+
+        Returns:
+            bool: True if it was sent
+        """
+        now = time.perf_counter()
+        if self.sent is not None and (
+            now < self.busy_until
+            or all(
+                abs(new - old) < band
+                for new, old, band in zip(position, self.sent, self.deadband)
+            )
+        ):
+            self.held_commands += 1
+            return False
+
+        duration = self.move_duration(position, speed)
+        send_message_G1(*position, speed)
+        self.busy_until = now + max(self.min_interval, duration)
+        self.sent = position
+        self.commanded_z.value = position[4]
+        self.sent_commands += 1
+        return True
+
+
+PLANNER = MotionPlanner()
 
 
 def homing(
@@ -32,10 +132,38 @@ def homing(
     """
     print('HOMING...')
     send_message_G1(j6, j5, x, y, z, speed)
+    PLANNER.reset((j6, j5, x, y, z))
     time.sleep(3)  # wait for the robot to home
     print('HOMED')
 
 
+async def homing_async(
+    j6: float = HOME_J6,
+    j5: float = HOME_J5,
+    x: float = HOME_X,
+    y: float = HOME_Y,
+    z: float = HOME_Z,
+    speed: float = HOME_SPEED,
+):
+    """Homing the robot without blocking the event loop
+
+    Instead of fixed sleeps, waits for the last move and the homing move by
+    their estimated duration (see `MotionPlanner`).
+
+    Args:
+        j6, j5, x, y, z (float, optional): home position
+        speed (float, optional): selected speed (mm/min) for homing
+    """
+    await asyncio.sleep(max(0.0, PLANNER.busy_until - time.perf_counter()))
+    print('HOMING...')
+    home = j6, j5, x, y, z
+    duration = PLANNER.move_duration(home, speed)
+    send_message_G1(j6, j5, x, y, z, speed)
+    PLANNER.reset(home)
+    await asyncio.sleep(duration)
+    print('HOMED')
+
+
 def move_arm(
     new_J6: float,
     new_J5: float,
@@ -48,9 +176,13 @@ def move_arm(
     Y: float,
     Z: float,
     speed=MEAN_SPEED,
+    planner: MotionPlanner = PLANNER,
 ) -> tuple[float, float, float, float, float]:
     """Move robot to designated coordinates
 
+    The new position is clamped to the workspace and goes through the
+    planner, which may hold it back until more motion adds up.
+
     Args:
         new_J6, new_J5 (float): degrees to add
         new_x, new_y, new_z (float): distance to add
@@ -58,6 +190,8 @@ def move_arm(
         X, Y, Z (float): current XYZ position
         speed (float, optional): requested speed of the robot's movement.
         Defaults to `MEAN_SPEED`.
+        planner (MotionPlanner, optional): decides what is sent. Defaults to
+        `PLANNER`.
 
     Returns:
         tuple[float, float, float, float, float]: new angles and positions
@@ -68,6 +202,46 @@ def move_arm(
     Y += new_y
     Z += new_z
 
-    send_message_G1(J6, J5, X, Y, Z, speed)
+    J6, J5, X, Y, Z = planner.clamp((J6, J5, X, Y, Z))
+    planner.submit((J6, J5, X, Y, Z), speed)
 
     return J6, J5, X, Y, Z
+
+
+def robot_step(
+    estimates: dict,
+    capture_time: float,
+    position: tuple,
+    command_index: int,
+    fusion: MotionFusion,
+    predictor: MotionPredictor = None,
+) -> tuple[float, float, float, float, float]:
+    """Turn one set of camera results into a robot command
+
+    Fuses the estimates, compensates the latency, moves the arm and records
+    the command's age (metrics, telemetry). Shared by every robot loop.
+
+    Args:
+        estimates (dict): camera ID -> (rotation, x, y, confidence)
+        capture_time (float): (perf_counter) oldest capture among them
+        position (tuple): current J6, J5, X, Y, Z
+        command_index (int): index of the command, tags its spans
+        fusion (MotionFusion): combination of the cameras' estimates
+        predictor (MotionPredictor, optional): latency compensation of the
+        fused motion. Defaults to None (apply the motion as measured).
+
+    Returns:
+        tuple[float, float, float, float, float]: new position
+    """
+    set_context(None, command_index)  # robot spans have no camera
+    with span('fusion'):
+        increments = fusion(estimates)
+    if predictor is not None:
+        with span('predict'):
+            increments = predictor(increments, capture_time)
+    with span('move_arm'):
+        position = move_arm(*increments, *position)
+    latency = time.perf_counter() - capture_time
+    COMMAND_AGE_SECONDS.labels().observe(latency)
+    TELEMETRY.record_command(command_index, capture_time, position, latency)
+    return position
@@ -1,85 +1,411 @@
 """Tracking of the surface"""
 
+import contextlib
+import time
+from typing import NamedTuple, Optional
+
 import cv2
 import numpy as np
 
-from config.tracker import APPROX_FUNC, FLANN, FLANN_THRESHOLD, SIFT
+from config.tracker import (
+    DEFAULT_TRACKER,
+    FLANN_THRESHOLD,
+    KLT_MAX_CORNERS,
+    KLT_MAX_LEVEL,
+    KLT_MIN_DISTANCE,
+    KLT_MIN_POINTS,
+    KLT_QUALITY,
+    KLT_WIN_SIZE,
+    MOTION_ESTIMATOR,
+    ORB_FEATURES,
+    RANSAC_REPROJ_THRESHOLD,
+    SIFT_FEATURES,
+    index_params,
+    lsh_index_params,
+    search_params,
+)
+from helpers.tracing import span
+from image_processing import CameraState, filter_ROI
+
+ESTIMATORS = {'ransac': cv2.RANSAC, 'lmeds': cv2.LMEDS}
+
+
+def _extract(
+    roi: np.ndarray,
+    origin: np.ndarray,
+    detector: cv2.Feature2D,
+    float_descriptors: bool,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Key points (in frame coordinates) and descriptors of the ROI"""
+    with span('detectAndCompute'):
+        kpnts, desc = detector.detectAndCompute(roi, None)
+    if desc is None:
+        raise ValueError("No features found in the ROI")
+    if float_descriptors:
+        desc = np.float32(desc)
+    points = np.float32([kp.pt for kp in kpnts]).reshape(-1, 1, 2) + origin
+    return points, desc
 
 
 def track(
     roi_cur: np.ndarray,
-    roi_prev: np.ndarray,
-    kpnts_prev: np.ndarray = None,
+    roi_prev: np.ndarray = None,
+    points_prev: np.ndarray = None,
     desc_prev: np.ndarray = None,
-    dst_pnts: np.ndarray = None,
-) -> tuple[np.ndarray, int, int, np.ndarray, np.ndarray, np.ndarray]:
-    """Track the wound and estimate its displacement
+    origin: tuple[int, int] = (0, 0),
+    detector: cv2.Feature2D = None,
+    matcher: cv2.DescriptorMatcher = None,
+    float_descriptors: bool = True,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Match the wound's features between the previous and current ROI
 
     Args:
         roi_cur (np.ndarray): current ROI
-        roi_prev (np.ndarray): previous ROI to compare with
-        kpnts_prev (np.ndarray, optional): key points in the previous frame
+        roi_prev (np.ndarray, optional): previous ROI, needed only if its
+        features are not given
+        points_prev (np.ndarray, optional): key points in the previous frame
+        (frame coordinates)
         desc_prev (np.ndarray, optional): descriptors in the previous frame
-        dst_pnts (np.ndarray, optional): destination points in the previous frame
+        origin (tuple[int, int], optional): (x, y) of the ROIs in the frame.
+        Defaults to (0, 0).
+        detector (cv2.Feature2D, optional): feature extractor. Defaults to
+        a new SIFT.
+        matcher (cv2.DescriptorMatcher, optional): feature matcher. Defaults
+        to a new FLANN (KD-tree) matcher.
+        float_descriptors (bool, optional): convert descriptors to float32
+        (KD-tree FLANN), False for binary descriptors. Defaults to True.
 
     Returns:
-        tuple[np.ndarray, int, int, np.ndarray, np.ndarray, np.ndarray]:
+        tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         source points,
-        X- and Y-axes displacement (px),
+        destination points,
         key points,
-        descriptors,
-        and destination points of the current frame
+        and descriptors of the current frame (points in frame coordinates)
     """
+    if detector is None:
+        detector = cv2.SIFT_create(nfeatures=SIFT_FEATURES)
+    if matcher is None:
+        matcher = cv2.FlannBasedMatcher(index_params, search_params)
+    origin = np.float32(origin)
     ## if it is not the first run, use previously calculated values as values
     ## for the `roi_prev`, otherwise calculate them
-    if kpnts_prev:
-        src_pnts = dst_pnts
-    else:
-        kpnts_prev, desc_prev = SIFT.detectAndCompute(roi_prev, None)
-        src_pnts = None
+    if points_prev is None or desc_prev is None:
+        points_prev, desc_prev = _extract(roi_prev, origin, detector, float_descriptors)
 
     # extract features from the current ROI
-    kpnts_cur, desc_cur = SIFT.detectAndCompute(roi_cur, None)
-    desc_prev = np.float32(desc_prev)
-    desc_cur = np.float32(desc_cur)
+    points_cur, desc_cur = _extract(roi_cur, origin, detector, float_descriptors)
 
     # match features, apply Lowe's ratio to filter bad matches
-    matcher = FLANN.knnMatch(desc_prev, desc_cur, k=2)
+    with span('knnMatch'):
+        pairs = matcher.knnMatch(desc_prev, desc_cur, k=2)
     matches = []  # good matches
-    for m, n in matcher:
-        if m.distance < FLANN_THRESHOLD * n.distance:
-            matches.append(m)
+    for pair in pairs:
+        # LSH may find less than two neighbours
+        if len(pair) == 2 and pair[0].distance < FLANN_THRESHOLD * pair[1].distance:
+            matches.append(pair[0])
 
     # find features old and new coordinates
-    if not src_pnts:
-        src_pnts = np.float32([kpnts_prev[m.queryIdx].pt for m in matches]).reshape(
-            -1, 1, 2
-        )
-    dst_pnts = np.float32([kpnts_cur[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
-
-    # calculate the median displacement
-    moved_X = APPROX_FUNC(dst_pnts[:, 0, 0] - src_pnts[:, 0, 0])
-    moved_Y = APPROX_FUNC(dst_pnts[:, 0, 1] - src_pnts[:, 0, 1])
-
-    return (
-        src_pnts,
-        moved_X,
-        moved_Y,
-        kpnts_cur,
-        desc_cur,
-        dst_pnts,
-    )
+    src_pnts = points_prev[np.array([m.queryIdx for m in matches], dtype=int)]
+    dst_pnts = points_cur[np.array([m.trainIdx for m in matches], dtype=int)]
+
+    return src_pnts, dst_pnts, points_cur, desc_cur
+
 
+class TrackResult(NamedTuple):
+    """Motion between the previous and the current ROI"""
 
-def rotation(src_pnts: np.ndarray, dst_pnts: np.ndarray) -> float:
-    """Estimate rotation
+    dx: float  # (px) displacement along the columns
+    dy: float  # (px) displacement along the rows
+    rotation: float  # (deg) rotation in the image plane
+    scale: float  # size ratio, > 1 if the surface came closer to the camera
+    matches: Optional[int]  # point correspondences, None if not point based
+    confidence: float  # [0 ... 1] inlier ratio or correlation response
+
+
+def estimate_motion(
+    src_pnts: np.ndarray,
+    dst_pnts: np.ndarray,
+    method: str = MOTION_ESTIMATOR,
+) -> TrackResult:
+    """Estimate translation, rotation and scale in one robust fit
+
+    Fits a 4-DOF similarity transform. The displacement is the one of the
+    inliers' centre, so a rotation around the ROI corner is not mistaken for
+    a translation.
 
     Args:
         src_pnts (np.ndarray): source points
         dst_pnts (np.ndarray): destination points
+        method (str, optional): "ransac" or "lmeds". Defaults to
+        `MOTION_ESTIMATOR`.
+
+    Returns:
+        TrackResult: estimated motion
+    """
+    if len(src_pnts) < 3:
+        raise ValueError(f"Not enough matches to estimate motion: {len(src_pnts)}")
+    with span('cv2.estimateAffinePartial2D'):
+        M, inliers = cv2.estimateAffinePartial2D(
+            src_pnts,
+            dst_pnts,
+            method=ESTIMATORS[method],
+            ransacReprojThreshold=RANSAC_REPROJ_THRESHOLD,
+        )
+    if M is None:
+        raise ValueError("Motion could not be estimated")
+
+    inliers = inliers.ravel().astype(bool)
+    centre = src_pnts.reshape(-1, 2)[inliers].mean(axis=0)
+    dx, dy = M[:, :2] @ centre + M[:, 2] - centre
+    return TrackResult(
+        float(dx),
+        float(dy),
+        float(np.degrees(np.arctan2(M[1, 0], M[0, 0]))),
+        float(np.hypot(M[0, 0], M[1, 0])),
+        len(src_pnts),
+        float(inliers.mean()),
+    )
+
+
+class Tracker:
+    """Motion estimation between the previous and the current ROI
+
+    Every backend returns a `TrackResult` and keeps the duration (s) of its
+    stages in the last call in `timings`. Whatever has to be carried over to
+    the next frame is kept in the camera's `CameraState`. Point-based
+    backends undistort their points with `calibration`, if it is set.
+    """
+
+    name = 'tracker'
+
+    def __init__(self):
+        self.timings = {}
+        self.calibration = None  # `CameraCalibration` of the camera
+
+    def undistorted(
+        self,
+        src_pnts: np.ndarray,
+        dst_pnts: np.ndarray,
+        origin: np.ndarray = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Matched points corrected for the lens distortion
+
+        Args:
+            src_pnts, dst_pnts (np.ndarray): (N, 1, 2) matched points
+            origin (np.ndarray, optional): (x, y) of the points' ROI in the
+            frame, None if they are in frame coordinates
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: undistorted points (frame
+            coordinates if calibrated)
+        """
+        if self.calibration is None or not self.calibration.undistorts:
+            return src_pnts, dst_pnts
+        if origin is not None:
+            src_pnts, dst_pnts = src_pnts + origin, dst_pnts + origin
+        with span('undistortPoints'):
+            return (
+                self.calibration.undistort_points(src_pnts),
+                self.calibration.undistort_points(dst_pnts),
+            )
+
+    @contextlib.contextmanager
+    def timed(self, stage: str):
+        """Time a stage into `timings` and the trace"""
+        start = time.perf_counter()
+        with span(f'{self.name}.{stage}'):
+            yield
+        self.timings[stage] = time.perf_counter() - start
+
+    def update(
+        self,
+        roi_cur: np.ndarray,
+        box: tuple[int, int, int, int],
+        state: CameraState,
+    ) -> TrackResult:
+        """Estimate the motion from the previous frame to `roi_cur`
+
+        Args:
+            roi_cur (np.ndarray): current filtered ROI
+            box (tuple[int, int, int, int]): crop box of `roi_cur` in the
+            frame (row min/max, column min/max)
+            state (CameraState): previous frame of the camera
+
+        Returns:
+            TrackResult: estimated motion
+        """
+        raise NotImplementedError
+
+    def warm_up(self, gray: np.ndarray):
+        """Track the centre of a frame against itself once
+
+        Pays one-off costs (allocations, matcher index) before the first
+        real frame. Nothing is carried over.
+
+        Args:
+            gray (np.ndarray): frame in grayscale, e.g. the camera's first one
+        """
+        height, width = gray.shape[:2]
+        box = height // 4, height * 3 // 4, width // 4, width * 3 // 4
+        roi = filter_ROI(gray[box[0] : box[1], box[2] : box[3]])
+        try:
+            self.update(roi, box, CameraState(gray))
+        except (ValueError, cv2.error):
+            pass  # nothing to track on this frame, the work is done anyway
+
+
+class FeatureTracker(Tracker):
+    """Feature extraction and matching, e.g. SIFT + FLANN
+
+    Features of the current ROI are kept as the previous ones of the next
+    frame, so every frame is extracted once.
+
+    Args:
+        name (str): backend name
+        detector (cv2.Feature2D): feature extractor
+        matcher (cv2.DescriptorMatcher): feature matcher
+        float_descriptors (bool): convert descriptors to float32
+    """
+
+    def __init__(
+        self,
+        name: str,
+        detector: cv2.Feature2D,
+        matcher: cv2.DescriptorMatcher,
+        float_descriptors: bool,
+    ):
+        super().__init__()
+        self.name = name
+        self.detector = detector
+        self.matcher = matcher
+        self.float_descriptors = float_descriptors
+
+    def update(self, roi_cur, box, state):
+        # the previous ROI is only needed if its features are not kept
+        roi_prev = state.previous_roi(box) if state.descriptors is None else None
+
+        with self.timed('match'):
+            src_pnts, dst_pnts, state.points, state.descriptors = track(
+                roi_cur,
+                roi_prev,
+                state.points,
+                state.descriptors,
+                (box[2], box[0]),
+                self.detector,
+                self.matcher,
+                self.float_descriptors,
+            )
+
+        src_pnts, dst_pnts = self.undistorted(src_pnts, dst_pnts)
+        with self.timed('estimate'):
+            return estimate_motion(src_pnts, dst_pnts)
+
+
+class OpticalFlowTracker(Tracker):
+    """Pyramidal Lucas-Kanade optical flow
+
+    Tracked points are carried over to the next frame in frame coordinates,
+    new corners are detected only when too few of them stay inside the ROI.
+    """
+
+    name = 'klt'
+
+    def update(self, roi_cur, box, state):
+        roi_prev = state.previous_roi(box)
+        origin = np.float32([box[2], box[0]])  # (x, y) of the ROI in the frame
+        points = None
+        if state.points is not None:
+            points = state.points - origin
+            height, width = roi_prev.shape[:2]
+            inside = (
+                (points[:, 0, 0] >= 0)
+                & (points[:, 0, 0] < width)
+                & (points[:, 0, 1] >= 0)
+                & (points[:, 0, 1] < height)
+            )
+            points = points[inside]
+
+        if points is None or len(points) < KLT_MIN_POINTS:
+            with self.timed('detect'):
+                points = cv2.goodFeaturesToTrack(
+                    roi_prev, KLT_MAX_CORNERS, KLT_QUALITY, KLT_MIN_DISTANCE
+                )
+            if points is None:
+                raise ValueError("No corners found in the ROI")
+
+        with self.timed('flow'):
+            next_points, status, _ = cv2.calcOpticalFlowPyrLK(
+                roi_prev,
+                roi_cur,
+                points,
+                None,
+                winSize=KLT_WIN_SIZE,
+                maxLevel=KLT_MAX_LEVEL,
+            )
+        found = status.ravel() == 1
+        src_pnts, dst_pnts = points[found], next_points[found]
+        state.points, state.descriptors = dst_pnts + origin, None
+
+        src_pnts, dst_pnts = self.undistorted(src_pnts, dst_pnts, origin)
+        with self.timed('estimate'):
+            return estimate_motion(src_pnts, dst_pnts)
+
+
+class PhaseCorrelationTracker(Tracker):
+    """Phase correlation of the whole ROI, translation only"""
+
+    name = 'phase'
+
+    def __init__(self):
+        super().__init__()
+        self._window = None
+
+    def update(self, roi_cur, box, state):
+        roi_prev = state.previous_roi(box)
+        with self.timed('correlate'):
+            if self._window is None or self._window.shape != roi_cur.shape:
+                self._window = cv2.createHanningWindow(roi_cur.shape[::-1], cv2.CV_32F)
+            (dx, dy), response = cv2.phaseCorrelate(
+                np.float32(roi_prev), np.float32(roi_cur), self._window
+            )
+        return TrackResult(dx, dy, 0.0, 1.0, None, response)
+
+
+TRACKERS = {
+    'sift': lambda: FeatureTracker(
+        'sift',
+        cv2.SIFT_create(nfeatures=SIFT_FEATURES),
+        cv2.FlannBasedMatcher(index_params, search_params),
+        True,
+    ),
+    'orb': lambda: FeatureTracker(
+        'orb',
+        cv2.ORB_create(nfeatures=ORB_FEATURES),
+        cv2.BFMatcher(cv2.NORM_HAMMING),
+        False,
+    ),
+    'akaze': lambda: FeatureTracker(
+        'akaze',
+        cv2.AKAZE_create(),
+        cv2.FlannBasedMatcher(lsh_index_params, search_params),
+        False,
+    ),
+    'klt': OpticalFlowTracker,
+    'phase': PhaseCorrelationTracker,
+}
+
+
+def make_tracker(name: str = DEFAULT_TRACKER) -> Tracker:
+    """Create a tracker backend
+
+    Every camera needs its own tracker, they keep state between frames.
+
+    Args:
+        name (str, optional): one of `TRACKERS`. Defaults to `DEFAULT_TRACKER`.
 
     Returns:
-        float: (deg) occurred rotation in one plane
+        Tracker: new tracker
     """
-    M, _ = cv2.findHomography(src_pnts, dst_pnts, cv2.RANSAC, ransacReprojThreshold=3.0)
-    return np.degrees(np.arctan2(M[1, 0], M[0, 0]))
+    if name not in TRACKERS:
+        raise ValueError(f"Unknown tracker {name!r}, use one of {list(TRACKERS)}")
+    return TRACKERS[name]()
@@ -1,89 +1,454 @@
 """Processing of the every camera's frame together in sync"""
 
+import os
 import queue
 import threading
+import time
 import traceback
+from typing import Callable, Optional, Union
 
 import cv2
+import numpy as np
 
-from config.camera import FRAME_HEIGHT, FRAME_WIDTH, SCALE
-from image_processing import convert_to_world_values, crop_ROI, segmentation
-from tracking import rotation, track
+from config.camera import (
+    DYNAMIC_SCALE,
+    DYNAMIC_SCALE_RANGE,
+    FRAME_HEIGHT,
+    FRAME_SAMPLING,
+    FRAME_TO_SKIP,
+    FRAME_WIDTH,
+    MAX_SAMPLE_RATE,
+    REPLAY_REALTIME,
+    UNDISTORT,
+)
+from config.model import (
+    KEYFRAME_INTERVAL,
+    KEYFRAME_MIN_INLIER_RATIO,
+    KEYFRAME_MIN_MATCHES,
+    KEYFRAME_MIN_PHASE_RESPONSE,
+    ROI_BORDER,
+)
+from config.runtime import WARM_UP
+from config.telemetry import TELEMETRY_ENABLED, TELEMETRY_PATH
+from config.tracing import TRACE_PATH
+from config.tracker import DEFAULT_TRACKER, TRACKER_BACKENDS
+from helpers.calibration import CameraCalibration
+from helpers.frame_pool import FramePool
+from helpers.frame_sources import open_frame_source
+from helpers.metrics import FAILURES, FRAMES_PROCESSED, FRAMES_SKIPPED, STAGE_SECONDS
+from helpers.startup import mark
+from helpers.telemetry import TELEMETRY
+from helpers.tracing import TRACER, set_context, span
+from image_processing import (
+    CameraState,
+    convert_to_world_values,
+    crop_ROI,
+    segmentation,
+    shift_ROI,
+)
+from tracking import make_tracker
 
 
-def capture_frames(
-    camera_id: int,
-    movements: queue.Queue,
-    event: threading.Event,
-):
-    """Capture and process frame from the camera in a separate thread
+def needs_keyframe(
+    frames_since_keyframe: int,
+    matches: Optional[int],
+    confidence: float,
+    roi: tuple[int, int, int, int],
+    keyframe_interval: int = KEYFRAME_INTERVAL,
+) -> bool:
+    """Decide whether the next frame has to be segmented again
+
+    Args:
+        frames_since_keyframe (int): processed frames since the last
+        segmentation
+        matches (int | None): point correspondences of the last tracking,
+        None for trackers that do not match points
+        confidence (float): inlier ratio of the last tracking, or its
+        correlation response for trackers that do not match points
+        roi (tuple[int, int, int, int]): current wound bounding box
+        keyframe_interval (int, optional): segment at least every n-th
+        processed frame. Defaults to `KEYFRAME_INTERVAL`.
+
+    Returns:
+        bool: True if the ROI can't be propagated by tracking any more
+    """
+    row_min, row_max, col_min, col_max = roi
+    if matches is None:
+        min_confidence = KEYFRAME_MIN_PHASE_RESPONSE
+    else:
+        min_confidence = KEYFRAME_MIN_INLIER_RATIO
+    return (
+        frames_since_keyframe >= keyframe_interval
+        or (matches is not None and matches < KEYFRAME_MIN_MATCHES)
+        or confidence < min_confidence
+        # the wound may be leaving the frame
+        or row_min <= ROI_BORDER
+        or col_min <= ROI_BORDER
+        or row_max >= FRAME_HEIGHT - ROI_BORDER
+        or col_max >= FRAME_WIDTH - ROI_BORDER
+    )
+
+
+class CameraPipeline:
+    """Frame processing of one camera
+
+    Reads frames as configured by the sampling and turns each one into the
+    camera's motion estimate. Shared by the thread/process runtime
+    (`capture_frames`) and the asyncio one.
 
     Args:
         camera_id (int): current camera (top/side/bottom)
-        movements (queue.Queue): placeholder for displacement values
-        event (threading.Event): flagger to other threads
+        source (int | str, optional): camera index, recorded video or image
+        directory to read frames from. Defaults to `camera_id`.
+        realtime (bool, optional): replay recordings at recorded speed,
+        otherwise as fast as possible. Defaults to `REPLAY_REALTIME`.
+        frame_to_skip (int, optional): process every n-th frame in "skip"
+        sampling. Defaults to `FRAME_TO_SKIP`.
+        latencies (list, optional): if given, the processing time (s) of
+        every processed frame is appended to it
+        segment (Callable, optional): segmentation model, e.g. the shared
+        `InferenceService`. Defaults to the model of `segmentation`.
+        keyframe_interval (int, optional): segment every n-th processed
+        frame, or earlier if tracking degrades; in between the ROI is shifted
+        by the tracked motion. Defaults to `KEYFRAME_INTERVAL`.
+        sampling (str, optional): "skip" every `frame_to_skip`-th frame or
+        take the "latest" one. Defaults to `FRAME_SAMPLING`.
+        tracker (str, optional): tracker backend. Defaults to the camera's
+        one in `TRACKER_BACKENDS`.
     """
-    # initialise variables
-    roi_prev = None
-    kpnts, desc, dest_pnts = None, None, None
-    # read every 30th frame
-    frame_to_skip = 30
-    current_frame_index = -1
-
-    # open camera
-    camera = cv2.VideoCapture(camera_id, cv2.CAP_DSHOW)
-    camera.set(cv2.CAP_PROP_BUFFERSIZE, 0)
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
-
-    # read first frame and convert it to grayscale
-    _, roi_prev = camera.read()
-    gray_prev = cv2.cvtColor(roi_prev, cv2.COLOR_BGR2GRAY)
-
-    while True:
-        retrieve, frame = camera.read()
-
-        # if camera is closed, stop reading frames and send commands to the
-        # robot to home
+
+    def __init__(
+        self,
+        camera_id: int,
+        source: Union[int, str] = None,
+        realtime: bool = REPLAY_REALTIME,
+        frame_to_skip: int = FRAME_TO_SKIP,
+        latencies: list = None,
+        segment: Callable = None,
+        keyframe_interval: int = KEYFRAME_INTERVAL,
+        sampling: str = FRAME_SAMPLING,
+        tracker: str = None,
+    ):
+        self.camera_id = camera_id
+        self.source = camera_id if source is None else source
+        self.realtime = realtime
+        self.frame_to_skip = frame_to_skip
+        self.latencies = latencies
+        self.segment = segment
+        self.keyframe_interval = keyframe_interval
+        self.sampling = sampling
+
+        # initialise variables
+        self.tracker = make_tracker(
+            tracker or TRACKER_BACKENDS.get(camera_id, DEFAULT_TRACKER)
+        )
+        self.frame_index = -1
+        self.keyframe = True  # the first processed frame is always segmented
+        self.frames_since_keyframe = 0
+        self.shift = 0, 0  # (px) last tracked displacement
+
+        # lens correction of the tracked points or the ROIs, scale lookup
+        self.calibration = CameraCalibration.for_camera(camera_id)
+        self.crop = None  # plain slicing
+        if UNDISTORT == 'points':
+            self.tracker.calibration = self.calibration
+        elif UNDISTORT == 'roi' and self.calibration.undistorts:
+            self.crop = self.calibration.crop
+        self.scale_factor = self.calibration.scale()  # (mm/px)
+        self.first_frame = True
+
+        self.frames_to_grab = 0  # frames to skip before the next processed one
+        self.sample_interval = 1 / MAX_SAMPLE_RATE
+        self.sample_time = 0
+
+        self.camera = None
+        self.state = None
+        self.pool = FramePool()  # frame buffers reused for every frame
+
+        # metric series of the camera
+        self.processed = FRAMES_PROCESSED.labels(camera_id)
+        self.skipped = FRAMES_SKIPPED.labels(camera_id)
+        self.failures = {
+            stage: FAILURES.labels(camera_id, stage) for stage in ('segmentation', 'tracking')
+        }
+        self.stage_seconds = {
+            stage: STAGE_SECONDS.labels(camera_id, stage)
+            for stage in ('segmentation', 'track', 'total')
+        }
+
+    def open(self):
+        """Open the camera or recording and read its first frame"""
+        # in "latest" sampling a grabber thread keeps only the newest frame
+        self.camera = open_frame_source(
+            self.source, self.realtime, latest=self.sampling == 'latest'
+        )
+
+        # read first frame and convert it to grayscale, it is the previous
+        # frame of the first processed one
+        retrieve, frame = self.camera.read(self.pool.frame)
         if not retrieve:
-            print("STOPPING...")
-            movements.put((None, None, None))  # send None types instead of real values
-            event.set()  # set flag that the current thread finished iteration
-            camera.release()  # stop camera processing
-            print('STOPPED')
-            break
+            raise RuntimeError(
+                f"Camera {self.camera_id}: no frame from {self.source!r}"
+            )
+        self.state = CameraState(
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.pool.gray()), self.crop
+        )
+        mark(f'camera{self.camera_id} open')
 
-        # skip frames, do not process skipped
-        current_frame_index += 1
-        if current_frame_index % frame_to_skip != 0:
-            continue
+        # pay the tracker's one-off costs before the first frame
+        if WARM_UP:
+            start = time.perf_counter()
+            self.tracker.warm_up(self.state.gray)
+            mark(f'camera{self.camera_id} tracker warm-up', time.perf_counter() - start)
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)  # convert to gray
+    def delay(self) -> float:
+        """(s) to wait before the next `read`
 
-        # process frame
-        try:
-            mask = segmentation(gray)
+        In "latest" sampling the newest frame is taken as soon as the
+        previous one is done, but not more often than `MAX_SAMPLE_RATE`.
+        """
+        if self.sampling != 'latest':
+            return 0.0
+        return self.sample_time + self.sample_interval - time.perf_counter()
+
+    def read(self) -> tuple[bool, np.ndarray]:
+        """Read the next frame to process
+
+        Returns:
+            tuple[bool, np.ndarray]: False if the camera is closed, frame
+            (in the pool's buffer, valid until the next `read`)
+        """
+        previous_index = self.frame_index
+        if self.sampling == 'latest':
+            self.sample_time = time.perf_counter()
+            retrieve, frame = self.camera.read(self.pool.frame)
+            self.frame_index = self.camera.frame_index
+        else:
+            # skipped frames are only grabbed, never decoded
+            for _ in range(self.frames_to_grab):
+                self.camera.grab()
+            self.frame_index += self.frames_to_grab + 1
+            self.frames_to_grab = self.frame_to_skip - 1
+            retrieve, frame = self.camera.read(self.pool.frame)
+        if self.frame_index > previous_index + 1:
+            self.skipped.inc(self.frame_index - previous_index - 1)
+        return retrieve, frame
 
-            roi_cur, gray_prev, roi_prev = crop_ROI(gray, mask, roi_prev, gray_prev)
+    def release(self):
+        """Stop camera processing"""
+        if self.camera is not None:  # None if it failed to open
+            self.camera.release()
 
-            src_pnts, x, y, kpnts, desc, dest_pnts = track(
-                roi_cur,
-                roi_prev,
-                kpnts,
-                desc,
-                dest_pnts,
+    def process(
+        self, frame: np.ndarray, frame_time: float, z: Optional[float] = None
+    ) -> Optional[tuple]:
+        """Estimate the motion since the previous processed frame
+
+        Args:
+            frame (np.ndarray): BGR frame
+            frame_time (float): (perf_counter) when the frame was captured
+            z (float, optional): (mm) last commanded Z of the robot, picks
+            the scale. Defaults to None (the calibration's reference Z).
+
+        Returns:
+            tuple | None: rotation (deg), x, y (mm), confidence and
+            `frame_time`; None if the frame could not be processed
+        """
+        state = self.state
+        set_context(self.camera_id, self.frame_index)  # tag the stages' spans
+        with span('cvtColor'):
+            # convert to gray, into the buffer not holding the previous frame
+            gray = cv2.cvtColor(
+                frame, cv2.COLOR_BGR2GRAY, dst=self.pool.gray(state.gray)
             )
-            joint_rotation = rotation(src_pnts, dest_pnts)
-            x, y = convert_to_world_values(x, y, SCALE)
 
-            # put the frame in the queue with the movements values
-            movements.put((joint_rotation, x, y))
+        keyframe = self.keyframe
+        stage = 'segmentation'  # a missing wound fails in `crop_ROI`
+        try:
+            start = time.perf_counter()
+            if keyframe:
+                with span('segmentation'):
+                    roi = segmentation(gray, self.segment, self.pool)
+                self.frames_since_keyframe = 0
+            else:
+                roi = shift_ROI(state.wound, *self.shift)
+            segmented = time.perf_counter()
 
-            # set the event to signal that a frame has been processed
-            event.set()
+            with span('crop_ROI'):
+                roi_cur, box = crop_ROI(gray, roi, state.wound, crop=self.crop)
+            cropped = time.perf_counter()
+
+            stage = 'tracking'
+            with span('track'):
+                motion = self.tracker.update(roi_cur, box, state)
+            tracked = time.perf_counter()
+            joint_rotation = motion.rotation
 
             # reassign current frame as a previous one
-            gray_prev = gray
+            state.update(gray, roi, box, roi_cur)
+
+            self.shift = motion.dx, motion.dy
+            self.frames_since_keyframe += 1
+            self.keyframe = needs_keyframe(
+                self.frames_since_keyframe,
+                motion.matches,
+                motion.confidence,
+                roi,
+                self.keyframe_interval,
+            )
+
+            calibrated = self.calibration.scale(z)
+            if DYNAMIC_SCALE:
+                # chained from the calibrated scale since the last keyframe
+                base = calibrated if keyframe else self.scale_factor
+                low, high = DYNAMIC_SCALE_RANGE
+                self.scale_factor = min(
+                    max(base / motion.scale, low * calibrated), high * calibrated
+                )
+            else:
+                self.scale_factor = calibrated
+            x, y = convert_to_world_values(motion.dx, motion.dy, self.scale_factor)
         except Exception as e:
             # if there any runtime error in the code, log the error
             print(f"ERROR : {e}  {traceback.format_exc()}")
+            self.failures[stage].inc()
+            self.keyframe = True  # do not propagate a ROI we failed to track
+            state.reset()
+            return None
+
+        latency = time.perf_counter() - frame_time
+        if self.latencies is not None:
+            self.latencies.append(latency)
+        self.processed.inc()
+        if keyframe:
+            self.stage_seconds['segmentation'].observe(segmented - start)
+        self.stage_seconds['track'].observe(tracked - cropped)
+        self.stage_seconds['total'].observe(latency)
+        TELEMETRY.record_frame(
+            self.camera_id,
+            self.frame_index,
+            frame_time,
+            roi,
+            keyframe,
+            motion,
+            (segmented - start, cropped - segmented, tracked - cropped, latency),
+        )
+        if self.first_frame:
+            self.first_frame = False
+            mark(f'camera{self.camera_id} first frame', latency)
+            mark(f'camera{self.camera_id} first result')
+
+        # the movements values, how much they can be trusted and when the
+        # frame was captured
+        return joint_rotation, x, y, motion.confidence, frame_time
+
+
+def capture_frames(
+    camera_id: int,
+    movements: queue.Queue,
+    event: threading.Event = None,
+    source: Union[int, str] = None,
+    realtime: bool = REPLAY_REALTIME,
+    frame_to_skip: int = FRAME_TO_SKIP,
+    latencies: list = None,
+    segment: Callable = None,
+    keyframe_interval: int = KEYFRAME_INTERVAL,
+    sampling: str = FRAME_SAMPLING,
+    tracker: str = None,
+    ready: threading.Event = None,
+    commanded_z=None,
+):
+    """Capture and process frame from the camera in a separate thread
+
+    Args:
+        camera_id (int): current camera (top/side/bottom)
+        movements (queue.Queue): placeholder for displacement values, e.g.
+        the camera's `SyncChannel`
+        event (threading.Event, optional): flagger to other threads
+        ready (threading.Event, optional): wait for it (e.g. the model being
+        loaded) before processing the first frame
+        commanded_z (multiprocessing.RawValue, optional): last commanded Z
+        of the robot, e.g. `PLANNER.commanded_z`. Defaults to None (the
+        scale at the calibration's reference Z).
+        source, realtime, frame_to_skip, latencies, segment,
+        keyframe_interval, sampling, tracker: see `CameraPipeline`
+    """
+    pipeline = CameraPipeline(
+        camera_id,
+        source,
+        realtime,
+        frame_to_skip,
+        latencies,
+        segment,
+        keyframe_interval,
+        sampling,
+        tracker,
+    )
+    try:
+        pipeline.open()
+        if ready is not None:
+            ready.wait()
+
+        while True:
+            with span('read'):
+                delay = pipeline.delay()
+                if delay > 0:
+                    time.sleep(delay)
+                retrieve, frame = pipeline.read()
+            frame_time = time.perf_counter()
+
+            # if camera is closed, stop reading frames and send commands to the
+            # robot to home
+            if not retrieve:
+                break
+
+            # process frame
+            z = None if commanded_z is None else commanded_z.value
+            movement = pipeline.process(frame, frame_time, z)
+            if movement is None:
+                continue
+
+            # put the frame in the queue with the movements values
+            with span('queue_put'):
+                movements.put(movement)
+
+            # set the event to signal that a frame has been processed
+            if event is not None:
+                event.set()
+    finally:
+        # also when the camera fails: the robot stops waiting for it
+        print("STOPPING...")
+        movements.put((None,) * 5)  # send None types instead of real values
+        if event is not None:
+            event.set()  # set flag that the current thread finished iteration
+        pipeline.release()  # stop camera processing
+        print('STOPPED')
+
+
+def run_camera_process(
+    camera_id: int,
+    movements: queue.Queue,
+    segment: Callable,
+    kwargs: dict,
+):
+    """Run `capture_frames` as the main function of a worker process
+
+    Args:
+        camera_id (int): current camera
+        movements (multiprocessing.Queue): placeholder for displacement values
+        segment (Callable): segmentation of the main process, e.g.
+        `SharedSegmentation`
+        kwargs (dict): other arguments of `capture_frames`
+    """
+    # every process has its own tracer and recorder, keep their records in
+    # separate files
+    if TELEMETRY_ENABLED:
+        root, extension = os.path.splitext(TELEMETRY_PATH)
+        TELEMETRY.open(f"{root}_camera{camera_id}{extension}")
+
+    capture_frames(camera_id, movements, segment=segment, **kwargs)
+
+    TELEMETRY.close()
+    if TRACER.enabled:
+        root, extension = os.path.splitext(TRACE_PATH)
+        TRACER.dump(f"{root}_camera{camera_id}{extension}")